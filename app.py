@@ -1,13 +1,13 @@
 from dash import Dash
-import dash_bootstrap_components as dbc
 
 # Import modules 
 from layouts.main_layout import main_layout 
 from callbacks.app_callbacks import register_callbacks 
 
-# Stylesheets 
+# Stylesheets: Bootstrap's theme as dash-bootstrap-components links it, without importing the package 
+BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css'
 external_stylesheets = [ 
-    dbc.themes.BOOTSTRAP, 
+    BOOTSTRAP, 
     'assets/custom.css'  
 ]
 
@@ -18,8 +18,8 @@ app.title = 'Market Simulation ABM'
 # Server instance 
 server = app.server
 
-# Define layout 
-app.layout = main_layout 
+# Define layout: static, so it is built once here instead of on every page load 
+app.layout = main_layout() 
 
 # Define callbacks 
 register_callbacks(app) 
@@ -0,0 +1,95 @@
+// Live updates pushed by the server over server-sent events (see callbacks/stream.py).
+// Each frame carries the partial updates of every graph, with numeric arrays as base64 typed arrays.
+(function() {
+    var TYPED_ARRAYS = {
+        int8: Int8Array, uint8: Uint8Array, int16: Int16Array, uint16: Uint16Array,
+        int32: Int32Array, uint32: Uint32Array, float32: Float32Array, float64: Float64Array
+    };
+
+    var source = null;
+    var sessionId = null;
+    var market = null;
+
+    function decode(value) {
+        if (Array.isArray(value)) {
+            return value.map(decode);
+        }
+        if (value && typeof value === 'object') {
+            if (typeof value.bdata === 'string' && TYPED_ARRAYS[value.dtype]) {
+                var bytes = atob(value.bdata);
+                var buffer = new Uint8Array(bytes.length);
+                for (var i = 0; i < bytes.length; i++) {
+                    buffer[i] = bytes.charCodeAt(i);
+                }
+                return new TYPED_ARRAYS[value.dtype](buffer.buffer);
+            }
+            var decoded = {};
+            Object.keys(value).forEach(function(key) { decoded[key] = decode(value[key]); });
+            return decoded;
+        }
+        return value;
+    }
+
+    function assign(target, location, value) {
+        for (var i = 0; i < location.length - 1; i++) {
+            if (target[location[i]] === undefined) {
+                target[location[i]] = typeof location[i + 1] === 'number' ? [] : {};
+            }
+            target = target[location[i]];
+        }
+        target[location[location.length - 1]] = value;
+    }
+
+    function render(graphId, operations) {
+        var container = document.getElementById(graphId);
+        var gd = container && container.querySelector('.js-plotly-plot');
+        if (!gd || !gd.data || !window.Plotly) {
+            return;
+        }
+        var figure = {data: gd.data, layout: gd.layout};
+        operations.forEach(function(operation) {
+            // The figure patches only ever assign values
+            if (operation.operation === 'Assign') {
+                assign(figure, operation.location, decode(operation.params.value));
+            }
+        });
+        figure.layout.datarevision = (figure.layout.datarevision || 0) + 1;
+        window.Plotly.react(gd, figure.data, figure.layout);
+    }
+
+    function onFrame(event) {
+        var frame = JSON.parse(event.data);
+        Object.keys(frame.figures).forEach(function(graphId) {
+            render(graphId, frame.figures[graphId]);
+        });
+    }
+
+    function close() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        stream: {
+            // Called whenever the store changes: stream while the session runs
+            connect: function(store) {
+                if (!store || !store.push || !store.running) {
+                    close();
+                    return 'idle';
+                }
+                if (source && sessionId === store.session_id && market === (store.market || 0) &&
+                        source.readyState !== EventSource.CLOSED) {
+                    return 'streaming';
+                }
+                close();
+                sessionId = store.session_id;
+                market = store.market || 0;
+                source = new EventSource('/stream/' + encodeURIComponent(sessionId) + '?market=' + market);
+                source.onmessage = onFrame;
+                return 'streaming';
+            }
+        }
+    });
+})();
@@ -0,0 +1,141 @@
+"""
+Ticks per second of the vectorized engine against the number of agents.
+
+Run from the repository root:
+    python -m benchmarks.bench_engine
+"""
+import argparse
+import time
+
+import numpy as np
+
+from components.engine import tick
+from components.simulation import initialize_simulation_data, update_simulation_parameters, initial_values
+
+
+def legacy_run_simulation(sim_data):
+    """
+    The per-agent loop implementation the engine replaced, kept as a reference
+    """
+    max_stock = sim_data['max_stock']
+    producer_desired_stock = sim_data['producer_desired_stock']
+    consumer_desired_stock = sim_data['consumer_desired_stock']
+    max_trades = sim_data['max_trades']
+
+    sim_data['iteration'] += 1
+
+    min_selling_prices = np.array(sim_data['min_selling_prices'])
+    max_buying_prices = np.array(sim_data['max_buying_prices'])
+    goods_sellers = np.array(sim_data['goods_sellers'])
+    goods_buyers = np.array(sim_data['goods_buyers'])
+
+    for _ in range(max_trades):
+        ind_willing_to_sell = np.where((sim_data['market_price'] >= min_selling_prices) & (goods_sellers > 0))[0]
+        ind_willing_to_buy = np.where((sim_data['market_price'] <= max_buying_prices) & (goods_buyers < max_stock))[0]
+
+        if len(ind_willing_to_sell) == 0 or len(ind_willing_to_buy) == 0:
+            break
+
+        seller = np.random.choice(ind_willing_to_sell)
+        buyer = np.random.choice(ind_willing_to_buy)
+
+        goods_sellers[seller] -= 1
+        goods_buyers[buyer] += 1
+
+    sim_data['market_price'] = max(sim_data['market_price'] + np.sign(len(ind_willing_to_buy) - len(ind_willing_to_sell)), 1)
+
+    for i in range(len(goods_sellers)):
+        adjustment = np.sign(goods_sellers[i] - producer_desired_stock)
+        adjustment *= 10 if goods_sellers[i] >= max_stock else 1
+        min_selling_prices[i] = max(min_selling_prices[i] - adjustment, 1)
+
+    for i in range(len(goods_buyers)):
+        adjustment = np.sign(consumer_desired_stock - goods_buyers[i])
+        max_buying_prices[i] = max(max_buying_prices[i] + adjustment, 0)
+
+    goods_sellers = np.minimum(goods_sellers + sim_data['production'], max_stock)
+    goods_buyers = np.maximum(goods_buyers - sim_data['consumption'], 0)
+
+    sim_data['min_selling_prices'] = min_selling_prices.tolist()
+    sim_data['max_buying_prices'] = max_buying_prices.tolist()
+    sim_data['goods_sellers'] = goods_sellers.tolist()
+    sim_data['goods_buyers'] = goods_buyers.tolist()
+
+    return sim_data
+
+def make_sim_data(agents, seed):
+    np.random.seed(seed)
+    sim_data = initialize_simulation_data(agents, agents)
+    update_simulation_parameters(sim_data, initial_values['production'], initial_values['consumption'],
+                                 initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                 initial_values['consumer_desired_stock'], initial_values['max_trades'],
+                                 initial_values['market_price'])
+    return sim_data
+
+def check_equivalence(agents=40, ticks=500, seed=0):
+    """
+    Run the legacy loop and the engine from the same seed and compare every tick
+    """
+    legacy = make_sim_data(agents, seed)
+    engine = make_sim_data(agents, seed)
+    arrays = [np.array(engine[key]) for key in ('min_selling_prices', 'max_buying_prices', 'goods_sellers', 'goods_buyers')]
+    market_price = engine['market_price']
+
+    legacy_state = np.random.get_state()
+    engine_state = np.random.get_state()
+    for _ in range(ticks):
+        np.random.set_state(legacy_state)
+        legacy = legacy_run_simulation(legacy)
+        legacy_state = np.random.get_state()
+
+        np.random.set_state(engine_state)
+        market_price = tick(market_price, *arrays, engine['production'], engine['consumption'], engine['max_stock'],
+                               engine['producer_desired_stock'], engine['consumer_desired_stock'], engine['max_trades'],
+                               kernel='numpy')[0]
+        engine_state = np.random.get_state()
+
+        assert market_price == legacy['market_price']
+        for array, key in zip(arrays, ('min_selling_prices', 'max_buying_prices', 'goods_sellers', 'goods_buyers')):
+            assert array.tolist() == legacy[key], key
+
+def ticks_per_second(step, sim_data, seconds):
+    # Warm up outside the timed window, e.g. loading the compiled matching kernel
+    sim_data = step(sim_data)
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        sim_data = step(sim_data)
+        ticks += 1
+    return ticks / (time.perf_counter() - start)
+
+def engine_step(arrays_and_price):
+    arrays, market_price, params = arrays_and_price
+    market_price = tick(market_price, *arrays, *params)[0]
+    return arrays, market_price, params
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--seconds', type=float, default=1.0, help='wall clock per measurement')
+    parser.add_argument('--legacy-limit', type=int, default=10000, help='largest agent count to run the legacy loop at')
+    args = parser.parse_args()
+
+    check_equivalence()
+    print('engine matches the legacy loop tick for tick')
+    print(f"{'agents':>10} {'engine ticks/s':>16} {'legacy ticks/s':>16}")
+
+    for agents in args.agents:
+        sim_data = make_sim_data(agents, seed=0)
+        arrays = [np.array(sim_data[key]) for key in ('min_selling_prices', 'max_buying_prices', 'goods_sellers', 'goods_buyers')]
+        params = (sim_data['production'], sim_data['consumption'], sim_data['max_stock'],
+                  sim_data['producer_desired_stock'], sim_data['consumer_desired_stock'], sim_data['max_trades'])
+        engine_tps = ticks_per_second(engine_step, (arrays, sim_data['market_price'], params), args.seconds)
+
+        legacy_tps = float('nan')
+        if agents <= args.legacy_limit:
+            legacy_tps = ticks_per_second(legacy_run_simulation, sim_data, args.seconds)
+        print(f'{agents:>10} {engine_tps:>16.1f} {legacy_tps:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Server CPU and payload per frame: full figures against Plotly Patch updates.
+
+Run from the repository root:
+    python -m benchmarks.bench_figures
+"""
+import argparse
+import time
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+from components.figures import create_price_figure, create_stock_figure, patch_price_figure, patch_stock_figure
+from components.simulation import initial_values
+from components.state import initialize_state
+
+
+def full_frame(state, agents):
+    price_fig = create_price_figure(state, agents, agents, state['market_price'])
+    stock_fig = create_stock_figure(state, agents, agents, state['max_stock'],
+                                    state['producer_desired_stock'], state['consumer_desired_stock'])
+    return to_json_plotly([price_fig, stock_fig])
+
+def patch_frame(state, agents):
+    price_patch = patch_price_figure(state, agents, agents, state['market_price'])
+    stock_patch = patch_stock_figure(state, agents, agents, state['max_stock'],
+                                     state['producer_desired_stock'], state['consumer_desired_stock'])
+    return to_json_plotly([price_patch, stock_patch])
+
+def measure(frame, state, agents, seconds):
+    """
+    Frames per second of building and serializing both figures, and the payload size
+    """
+    payload = frame(state, agents)
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        frame(state, agents)
+        frames += 1
+    return (time.perf_counter() - start) / frames, len(payload)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, nargs='+', default=[40, 4000])
+    parser.add_argument('--seconds', type=float, default=1.0, help='wall clock per measurement')
+    args = parser.parse_args()
+
+    print(f"{'agents':>8} {'mode':>6} {'ms/frame':>10} {'payload bytes':>14}")
+    for agents in args.agents:
+        np.random.seed(0)
+        state = initialize_state(agents, agents)
+        state['market_price'] = initial_values['market_price']
+        for name, frame in (('full', full_frame), ('patch', patch_frame)):
+            seconds_per_frame, payload = measure(frame, state, agents, args.seconds)
+            print(f'{agents:>8} {name:>6} {seconds_per_frame * 1000:>10.2f} {payload:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Trade matching: the NumPy path against the compiled Numba kernel, for growing max_trades.
+
+Run from the repository root:
+    python -m benchmarks.bench_kernels
+"""
+import argparse
+import time
+
+import numpy as np
+
+from components.engine import execute_trades
+from components.kernels import NUMBA_AVAILABLE
+from components.simulation import initialize_simulation_data, initial_values
+
+
+def trades_per_second(kernel, agents, max_trades, seconds):
+    np.random.seed(0)
+    sim_data = initialize_simulation_data(agents, agents)
+    # Plenty of stock and room so every attempted trade goes through
+    goods_sellers = np.full(agents, 10 ** 9, dtype=np.int64)
+    goods_buyers = np.zeros(agents, dtype=np.int64)
+    market_price = initial_values['market_price']
+
+    def run():
+        return execute_trades(market_price, sim_data['min_selling_prices'], sim_data['max_buying_prices'],
+                              goods_sellers, goods_buyers, 10 ** 9, max_trades, kernel)[0]
+
+    run()
+    trades = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        trades += run()
+    return trades / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--max-trades', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--seconds', type=float, default=1.0, help='wall clock per measurement')
+    args = parser.parse_args()
+
+    if not NUMBA_AVAILABLE:
+        print('Numba is not installed, only the NumPy path is measured')
+    else:
+        # First call loads the kernel from the on-disk cache, or compiles and caches it
+        start = time.perf_counter()
+        execute_trades(1, np.ones(1, dtype=np.int64), np.ones(1, dtype=np.int64),
+                       np.ones(1, dtype=np.int64), np.zeros(1, dtype=np.int64), 1, 1, 'numba')
+        print(f'first numba call (compile or cache load): {time.perf_counter() - start:.3f}s')
+
+    print(f"{'max_trades':>10} {'numpy trades/s':>16} {'numba trades/s':>16} {'speedup':>8}")
+    for max_trades in args.max_trades:
+        numpy_tps = trades_per_second('numpy', args.agents, max_trades, args.seconds)
+        numba_tps = float('nan')
+        if NUMBA_AVAILABLE:
+            numba_tps = trades_per_second('numba', args.agents, max_trades, args.seconds)
+        print(f'{max_trades:>10} {numpy_tps:>16.0f} {numba_tps:>16.0f} {numba_tps / numpy_tps:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Memory footprint and per-tick allocations of the list dict, the array dict and MarketState.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from components.simulation import initialize_simulation_data, update_simulation_parameters, run_simulation_steps
+from components.simulation import initial_values
+from components.state import MarketState
+
+ARRAY_KEYS = ('min_selling_prices', 'max_buying_prices', 'goods_sellers', 'goods_buyers')
+
+
+def set_parameters(sim_data):
+    update_simulation_parameters(sim_data, initial_values['production'], initial_values['consumption'],
+                                 initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                 initial_values['consumer_desired_stock'], initial_values['max_trades'],
+                                 initial_values['market_price'])
+    return sim_data
+
+def traced(function):
+    """
+    Run function and return its result with the peak memory traced while it ran
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    return result, peak
+
+def tick_allocations(sim_data, ticks):
+    # Warm up outside the trace, e.g. loading the compiled matching kernel
+    run_simulation_steps(sim_data, 1)
+    start = time.perf_counter()
+    _, peak = traced(lambda: [run_simulation_steps(sim_data, 1) for _ in range(ticks)])
+    return peak, ticks / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=10 ** 6)
+    parser.add_argument('--ticks', type=int, default=10)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    sim_data = set_parameters(initialize_simulation_data(args.agents, args.agents))
+
+    list_data, list_bytes = traced(lambda: {key: value.tolist() if key in ARRAY_KEYS else value for key, value in sim_data.items()})
+    json_bytes = len(json.dumps(list_data))
+    array_bytes = sum(sim_data[key].nbytes for key in ARRAY_KEYS)
+    state = MarketState.from_dict(sim_data)
+
+    mb = 1024 ** 2
+    print(f'{args.agents} sellers and {args.agents} buyers')
+    print(f'list dict:   {list_bytes / mb:8.1f} MB in memory, {json_bytes / mb:8.1f} MB as JSON')
+    print(f'array dict:  {array_bytes / mb:8.1f} MB (int64)')
+    print(f'MarketState: {state.nbytes / mb:8.1f} MB (int32 arrays + tick buffers)')
+
+    print('peak allocation while ticking, per tick:')
+    for name, data in (('array dict', sim_data), ('MarketState', state)):
+        peak, ticks_per_second = tick_allocations(data, args.ticks)
+        print(f'{name:>12}: {peak / mb:8.2f} MB peak, {ticks_per_second:8.1f} ticks/s')
+
+
+if __name__ == '__main__':
+    main()
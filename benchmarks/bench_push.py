@@ -0,0 +1,207 @@
+"""
+Load test of live updates: many concurrent viewers, each with a running session, under
+interval polling and under server-sent event push.
+
+Starts the app under gunicorn once per mode, opens the viewers against it and reports the
+frames each viewer received per second, the bytes it downloaded per second, and the server's
+CPU use and resident memory (read from /proc, so Linux only).
+
+Run from the repository root:
+    python -m benchmarks.bench_push --viewers 100 --seconds 20
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+# Must match the dcc.Interval in layouts/main_layout.py
+POLL_INTERVAL = 0.9
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(mode, port, threads):
+    env = dict(os.environ, LIVE_UPDATES=mode, SESSION_DIR='')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:server', '--workers', '1', '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        env=env)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            requests.get(url + '/_dash-layout', timeout=1)
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('server did not start')
+
+def server_usage(pid):
+    """
+    CPU seconds used so far and resident memory in bytes of a process and its children,
+    i.e. the gunicorn master and its workers
+    """
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        pids = [pid] + [int(child) for child in file.read().split()]
+    cpu = rss = 0
+    for process in pids:
+        with open(f'/proc/{process}/stat') as file:
+            fields = file.read().rsplit(')', 1)[1].split()
+        cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f'/proc/{process}/status') as file:
+            rss += next(int(line.split()[1]) * 1024 for line in file if line.startswith('VmRSS'))
+    return cpu, rss
+
+def component_values(layout):
+    """
+    id -> props of every component in the layout JSON
+    """
+    values = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            props = node.get('props', {})
+            if 'id' in props:
+                values[props['id']] = props
+            stack.append(props.get('children'))
+    return values
+
+class Viewer(threading.Thread):
+    """
+    One browser tab: starts its own run, then receives frames until told to stop
+    """
+
+    def __init__(self, mode, url, callback, layout, speed, stop):
+        super().__init__(daemon=True)
+        self.mode = mode
+        self.url = url
+        self.callback = callback
+        self.layout = layout
+        self.speed = speed
+        self.stop = stop
+        self.session = requests.Session()
+        self.store = dict(layout['simulation-data']['data'], session_id=uuid.uuid4().hex)
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.latencies = []
+
+    def update(self, trigger):
+        inputs = []
+        for spec in self.callback['inputs']:
+            value = self.layout[spec['id']].get(spec['property'], 0)
+            if spec['id'] == 'ticks-per-second-slider':
+                value = self.speed
+            inputs.append(dict(spec, value=value))
+        state = [dict(spec, value=self.store if spec['id'] == 'simulation-data' else self.layout[spec['id']].get(spec['property']))
+                 for spec in self.callback['state']]
+        body = {'output': self.callback['output'], 'outputs': self.outputs, 'inputs': inputs,
+                'state': state, 'changedPropIds': [trigger]}
+        start = time.perf_counter()
+        response = self.session.post(self.url + '/_dash-update-component', json=body)
+        self.latencies.append(time.perf_counter() - start)
+        if response.status_code == 200:
+            self.store = response.json()['response']['simulation-data']['data']
+        return response
+
+    def run(self):
+        try:
+            self.receive()
+        except requests.RequestException:
+            # Connections are cut when the server stops at the end of a measurement
+            if not self.stop.is_set():
+                self.errors += 1
+
+    def receive(self):
+        self.outputs = [{'id': output.split('.')[0], 'property': output.split('.')[1]}
+                        for output in self.callback['output'].strip('.').split('...')]
+        self.update('start-button.n_clicks')
+        self.latencies.clear()
+
+        if self.mode == 'poll':
+            while not self.stop.is_set():
+                start = time.perf_counter()
+                response = self.update('interval-component.n_intervals')
+                if response.status_code == 200:
+                    self.frames += 1
+                self.bytes += len(response.content)
+                self.stop.wait(max(POLL_INTERVAL - (time.perf_counter() - start), 0))
+        else:
+            with self.session.get(f"{self.url}/stream/{self.store['session_id']}", stream=True) as response:
+                for line in response.iter_lines(chunk_size=None):
+                    self.bytes += len(line) + 1
+                    if line.startswith(b'data:'):
+                        self.frames += 1
+                    if self.stop.is_set():
+                        break
+
+def measure(mode, viewers, speed, seconds, threads):
+    port = free_port()
+    server, url = start_server(mode, port, threads)
+    try:
+        layout = component_values(requests.get(url + '/_dash-layout').json())
+        callback = next(callback for callback in requests.get(url + '/_dash-dependencies').json()
+                        if 'price-graph.figure' in callback['output'])
+
+        stop = threading.Event()
+        tabs = [Viewer(mode, url, callback, layout, speed, stop) for _ in range(viewers)]
+        for tab in tabs:
+            tab.start()
+        # Let every viewer start its run before measuring
+        time.sleep(2)
+        for tab in tabs:
+            tab.frames = tab.bytes = 0
+            tab.latencies.clear()
+
+        cpu_start, _ = server_usage(server.pid)
+        time.sleep(seconds)
+        cpu_end, rss = server_usage(server.pid)
+        frames = sum(tab.frames for tab in tabs)
+        downloaded = sum(tab.bytes for tab in tabs)
+        latencies = sorted(latency for tab in tabs for latency in tab.latencies)
+        errors = sum(tab.errors for tab in tabs)
+        stop.set()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'frames_per_viewer': frames / viewers / seconds,
+        'bytes_per_viewer': downloaded / viewers / seconds,
+        'cpu': (cpu_end - cpu_start) / seconds,
+        'rss': rss,
+        'errors': errors,
+        'p95_latency': latencies[int(len(latencies) * 0.95)] if latencies else float('nan')
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--viewers', type=int, default=100)
+    parser.add_argument('--speed', type=float, default=1, help='ticks per second exponent of every run')
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--modes', nargs='+', default=['poll', 'push'], choices=['poll', 'push'])
+    parser.add_argument('--threads', type=int, default=128, help='gunicorn threads; a push viewer holds one')
+    args = parser.parse_args()
+
+    print(f"{'mode':>5} {'viewers':>8} {'frames/s':>9} {'kB/s':>8} {'server CPU':>11} {'RSS MB':>8} {'p95 ms':>8} {'errors':>7}")
+    print('       (per viewer)    (per viewer)')
+    for mode in args.modes:
+        result = measure(mode, args.viewers, args.speed, args.seconds, max(args.threads, args.viewers + 8))
+        print(f"{mode:>5} {args.viewers:>8} {result['frames_per_viewer']:>9.2f} {result['bytes_per_viewer'] / 1024:>8.1f} "
+              f"{result['cpu'] * 100:>10.0f}% {result['rss'] / 1024 ** 2:>8.0f} {result['p95_latency'] * 1000:>8.0f} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Cold start and memory of the app as deployed.
+
+Reports
+    import      seconds to import app in a fresh interpreter (best of --repeats)
+    cold start  seconds from launching gunicorn with the Procfile's command to the first layout
+                served, and to the first update_simulation answered (the page fully drawn)
+    memory      resident (RSS) and proportional (PSS) memory of the gunicorn master and its
+                single worker after that first request. Read from /proc, so Linux only.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import requests
+
+from benchmarks.bench_push import component_values, free_port
+
+
+def procfile_command():
+    """
+    The Procfile's web command as gunicorn arguments
+    """
+    with open('Procfile') as file:
+        command = next(line.split(':', 1)[1] for line in file if line.startswith('web:'))
+    return shlex.split(command)[1:]
+
+def import_time():
+    code = 'import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)'
+    output = subprocess.run([sys.executable, '-c', code], env=dict(os.environ, SESSION_DIR=''),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+def process_memory(pid):
+    """
+    RSS and PSS of one process in bytes
+    """
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                memory[name.lower()] = int(value.split()[0]) * 1024
+    return memory
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+def first_update(url):
+    """
+    Answer the page's first update_simulation, as the browser sends it after loading the layout
+    """
+    layout = component_values(requests.get(url + '/_dash-layout').json())
+    spec = next(callback for callback in requests.get(url + '/_dash-dependencies').json()
+                if 'price-graph.figure' in callback['output'])
+    outputs = [{'id': output.split('.')[0], 'property': output.split('.')[1]}
+               for output in spec['output'].strip('.').split('...')]
+    inputs = [dict(input, value=layout[input['id']].get(input['property'], 0)) for input in spec['inputs']]
+    state = [dict(input, value=layout[input['id']].get(input['property'])) for input in spec['state']]
+    response = requests.post(url + '/_dash-update-component', json={
+        'output': spec['output'], 'outputs': outputs, 'inputs': inputs, 'state': state, 'changedPropIds': []})
+    response.raise_for_status()
+
+def cold_start(arguments):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', *arguments, '--bind', f'127.0.0.1:{port}',
+                               '--log-level', 'warning'], env=dict(os.environ, SESSION_DIR=''))
+    try:
+        while True:
+            try:
+                requests.get(url + '/_dash-layout', timeout=1).raise_for_status()
+                break
+            except (requests.ConnectionError, requests.Timeout):
+                if server.poll() is not None or time.perf_counter() - start > 60:
+                    raise RuntimeError('server did not start')
+                time.sleep(0.01)
+        layout_served = time.perf_counter() - start
+        first_update(url)
+        page_drawn = time.perf_counter() - start
+        memory = {'master': process_memory(server.pid)}
+        for index, worker in enumerate(children(server.pid)):
+            memory[f'worker {index}'] = process_memory(worker)
+        return layout_served, page_drawn, memory
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    arguments = procfile_command()
+    print('gunicorn', ' '.join(arguments))
+    print(f'import app          {min(import_time() for _ in range(args.repeats)):.3f} s')
+    runs = [cold_start(arguments) for _ in range(args.repeats)]
+    print(f'first layout        {min(run[0] for run in runs):.3f} s')
+    print(f'first update        {min(run[1] for run in runs):.3f} s')
+    memory = runs[-1][2]
+    for process, usage in memory.items():
+        print(f'{process:<18}  RSS {usage["rss"] / 2 ** 20:7.1f} MiB  PSS {usage["pss"] / 2 ** 20:7.1f} MiB')
+    print(f'{"total":<18}  RSS {sum(usage["rss"] for usage in memory.values()) / 2 ** 20:7.1f} MiB  '
+          f'PSS {sum(usage["pss"] for usage in memory.values()) / 2 ** 20:7.1f} MiB')
+
+if __name__ == '__main__':
+    main()
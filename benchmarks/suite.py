@@ -0,0 +1,354 @@
+"""
+Offline benchmark suite with scaling curves and a regression gate.
+
+Measures the throughput of
+    engine      run_simulation for 10 to 10 ** 6 agents per side (ticks per second)
+    max_trades  run_simulation for max_trades from 1 to 10 ** 4 at 10 ** 4 agents (ticks per second)
+    mechanisms  random pairing and the order book auction side by side, 10 to 10 ** 6 agents
+                (ticks per second and units traded per second)
+    markets     an economy of 10 to 1000 markets of 100 agents stepped together, against as many
+                separate single-market engines (ticks of every market per second)
+    ensemble    an ensemble of 10 to 1000 replicas of a market of 100 agents stepped together by
+                run_ensemble, against as many separate runs (ticks of every replica per second)
+    checkpoints seeking back into a run of SEEK_TICKS ticks and rerunning it through the checkpoint
+                cache, against recomputing from the initial state (seeks or reruns per second)
+    figures     create_price_figure / create_stock_figure and the histogram figures drawn for
+                large populations (figures per second)
+    callback    a full update_simulation request through the Flask test client, including
+                Dash's dispatch, the runner round trip and JSON serialization (requests per second)
+
+Each case is repeated and the best repeat is kept, which is the least noisy estimate on a
+shared machine. Results print as a table and can be written as JSON (--output) and as
+log-log scaling curves in a self-contained HTML page (--plot).
+
+Regression gate: record a baseline on the reference machine, then compare against it.
+The exit status is 1 when any case's throughput falls more than --tolerance below the
+baseline; cases that are not in the baseline are reported but never fail.
+
+Run from the repository root:
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json --tolerance 0.2
+    python -m benchmarks.suite --quick --only engine figures --plot curves.html
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from components.checkpoints import CheckpointCache, RunTimeline
+from components.ensemble import initialize_ensemble, run_ensemble
+from components.engine import DEFAULT_KERNEL, MECHANISMS
+from components.markets import initialize_markets, run_markets
+from components.figures import create_price_figure, create_stock_figure, create_price_histogram, create_stock_histogram
+from components.simulation import initial_values, update_simulation_parameters, run_simulation, run_simulation_steps
+from components.state import initialize_state
+
+GROUPS = ('engine', 'max_trades', 'mechanisms', 'markets', 'ensemble', 'checkpoints', 'figures', 'callback')
+RESULTS_VERSION = 1
+
+AGENTS = [10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6]
+MAX_TRADES = [1, 10, 100, 1000, 10 ** 4]
+MAX_TRADES_AGENTS = 10 ** 4
+BAR_AGENTS = [10, 100, 400]
+HISTOGRAM_AGENTS = [1000, 10 ** 4, 10 ** 5, 10 ** 6]
+MARKETS = [10, 100, 1000]
+MARKET_AGENTS = 100
+REPLICAS = [10, 100, 1000]
+REPLICA_AGENTS = 100
+CHECKPOINT_AGENTS = [100, 10 ** 4]
+SEEK_TICKS = 2000
+# The agent sliders stop at 10 ** 5
+CALLBACK_AGENTS = [10, 1000, 10 ** 5]
+
+# --quick drops the sizes that take longest
+QUICK_LIMITS = {'agents': 10 ** 4, 'max_trades': 1000}
+
+
+def measure(function, seconds, repeats):
+    """
+    Best calls per second over the repeats, each calling function for at least seconds
+    """
+    function()
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= seconds:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+def market(agents, max_trades=initial_values['max_trades'], mechanism=initial_values['mechanism']):
+    state = initialize_state(agents, agents, seed=0)
+    update_simulation_parameters(state, initial_values['production'], initial_values['consumption'],
+                                 initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                 initial_values['consumer_desired_stock'], max_trades,
+                                 initial_values['market_price'], mechanism)
+    return state
+
+def result(group, case, parameter, value, throughput, unit):
+    return {'key': f'{case}/{parameter}={value}', 'group': group, 'case': case,
+            'parameter': parameter, 'value': value, 'throughput': throughput, 'unit': unit}
+
+def bench_engine(sizes, seconds, repeats):
+    for agents in sizes['agents']:
+        state = market(agents)
+        yield result('engine', 'run_simulation', 'agents', agents,
+                     measure(lambda: run_simulation(state), seconds, repeats), 'ticks/s')
+
+def bench_max_trades(sizes, seconds, repeats):
+    for max_trades in sizes['max_trades']:
+        state = market(MAX_TRADES_AGENTS, max_trades)
+        yield result('max_trades', 'run_simulation_max_trades', 'max_trades', max_trades,
+                     measure(lambda: run_simulation(state), seconds, repeats), 'ticks/s')
+
+def bench_mechanisms(sizes, seconds, repeats):
+    for agents in sizes['agents']:
+        for mechanism in MECHANISMS:
+            state = market(agents, mechanism=mechanism)
+            traded = {'ticks': 0, 'units': 0}
+
+            def step():
+                history = run_simulation_steps(state, 1)[1]
+                traded['ticks'] += 1
+                traded['units'] += int(history['trades'][0])
+
+            ticks_per_second = measure(step, seconds, repeats)
+            yield result('mechanisms', f'run_simulation_{mechanism}', 'agents', agents, ticks_per_second, 'ticks/s')
+            yield result('mechanisms', f'{mechanism}_volume', 'agents', agents,
+                         ticks_per_second * traded['units'] / traded['ticks'], 'units/s')
+
+def bench_markets(sizes, seconds, repeats):
+    for markets in MARKETS:
+        economy = initialize_markets(markets, MARKET_AGENTS, MARKET_AGENTS, seed=0)
+        update_simulation_parameters(economy, initial_values['production'], initial_values['consumption'],
+                                     initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                     initial_values['consumer_desired_stock'], initial_values['max_trades'],
+                                     initial_values['market_price'])
+        yield result('markets', 'run_markets', 'markets', markets,
+                     measure(lambda: run_markets(economy, 1), seconds, repeats), 'ticks/s')
+
+        states = [market(MARKET_AGENTS) for _ in range(markets)]
+
+        def step_each():
+            for state in states:
+                run_simulation(state)
+
+        yield result('markets', 'separate_engines', 'markets', markets, measure(step_each, seconds, repeats), 'ticks/s')
+
+def bench_ensemble(sizes, seconds, repeats):
+    for replicas in REPLICAS:
+        ensemble = initialize_ensemble(replicas, REPLICA_AGENTS, REPLICA_AGENTS, seed=0)
+        update_simulation_parameters(ensemble, initial_values['production'], initial_values['consumption'],
+                                     initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                     initial_values['consumer_desired_stock'], initial_values['max_trades'],
+                                     initial_values['market_price'])
+        yield result('ensemble', 'run_ensemble', 'replicas', replicas,
+                     measure(lambda: run_ensemble(ensemble, 1), seconds, repeats), 'ticks/s')
+
+        # What sweep.py does without --replicas: one market per seed
+        states = [initialize_state(REPLICA_AGENTS, REPLICA_AGENTS, seed=seed) for seed in range(replicas)]
+        for state in states:
+            update_simulation_parameters(state, initial_values['production'], initial_values['consumption'],
+                                         initial_values['max_stock'], initial_values['producer_desired_stock'],
+                                         initial_values['consumer_desired_stock'], initial_values['max_trades'],
+                                         initial_values['market_price'])
+
+        def step_each():
+            for state in states:
+                run_simulation_steps(state, 1)
+
+        yield result('ensemble', 'separate_runs', 'replicas', replicas, measure(step_each, seconds, repeats), 'ticks/s')
+
+def bench_checkpoints(sizes, seconds, repeats):
+    for agents in [agents for agents in CHECKPOINT_AGENTS if agents <= max(sizes['agents'])]:
+        cache = CheckpointCache()
+        state = market(agents)
+        timeline = RunTimeline(state, cache)
+        state, _ = timeline.advance(state, SEEK_TICKS)
+        ticks = np.random.default_rng(0).integers(0, SEEK_TICKS, 64)
+        seeks = {'count': 0}
+
+        def seek():
+            timeline.seek(state, ticks[seeks['count'] % len(ticks)])
+            seeks['count'] += 1
+
+        def replay():
+            fresh = market(agents)
+            run_simulation_steps(fresh, int(ticks[seeks['count'] % len(ticks)]))
+            seeks['count'] += 1
+
+        yield result('checkpoints', 'seek_checkpointed', 'agents', agents, measure(seek, seconds, repeats), 'seeks/s')
+        yield result('checkpoints', 'seek_replay', 'agents', agents, measure(replay, seconds, repeats), 'seeks/s')
+
+        def rerun():
+            fresh = market(agents)
+            RunTimeline(fresh, cache).advance(fresh, SEEK_TICKS)
+
+        yield result('checkpoints', 'rerun_cached', 'agents', agents, measure(rerun, seconds, repeats), 'runs/s')
+        yield result('checkpoints', 'rerun_computed', 'agents', agents,
+                     measure(lambda: run_simulation_steps(market(agents), SEEK_TICKS), seconds, repeats), 'runs/s')
+
+def bench_figures(sizes, seconds, repeats):
+    max_stock = initial_values['max_stock']
+    desired = initial_values['producer_desired_stock'], initial_values['consumer_desired_stock']
+    for agents in BAR_AGENTS:
+        state = market(agents)
+        run_simulation(state)
+        yield result('figures', 'create_price_figure', 'agents', agents, measure(
+            lambda: create_price_figure(state, agents, agents, state['market_price']), seconds, repeats), 'figures/s')
+        yield result('figures', 'create_stock_figure', 'agents', agents, measure(
+            lambda: create_stock_figure(state, agents, agents, max_stock, *desired), seconds, repeats), 'figures/s')
+    for agents in [agents for agents in HISTOGRAM_AGENTS if agents <= max(sizes['agents'])]:
+        state = market(agents)
+        run_simulation(state)
+        yield result('figures', 'create_price_histogram', 'agents', agents, measure(
+            lambda: create_price_histogram(state, state['market_price']), seconds, repeats), 'figures/s')
+        yield result('figures', 'create_stock_histogram', 'agents', agents, measure(
+            lambda: create_stock_histogram(state, max_stock, *desired), seconds, repeats), 'figures/s')
+
+def bench_callback(sizes, seconds, repeats):
+    # Sessions stay in memory and the interval callback path is not used
+    os.environ['SESSION_DIR'] = ''
+    os.environ.setdefault('LIVE_UPDATES', 'push')
+    from app import app
+    from benchmarks.bench_push import component_values
+    from layouts.main_layout import agents_to_slider
+
+    client = app.server.test_client()
+    layout = component_values(client.get('/_dash-layout').get_json())
+    spec = next(callback for callback in client.get('/_dash-dependencies').get_json()
+                if 'price-graph.figure' in callback['output'])
+    outputs = [{'id': output.split('.')[0], 'property': output.split('.')[1]}
+               for output in spec['output'].strip('.').split('...')]
+
+    for agents in [agents for agents in CALLBACK_AGENTS if agents <= max(sizes['agents'])]:
+        values = {'sellers-slider': agents_to_slider(agents), 'buyers-slider': agents_to_slider(agents)}
+        store = {'data': dict(layout['simulation-data']['data'])}
+
+        def update(trigger):
+            inputs = [dict(input, value=values.get(input['id'], layout[input['id']].get(input['property'], 0)))
+                      for input in spec['inputs']]
+            state = [dict(input, value=store['data'] if input['id'] == 'simulation-data'
+                          else layout[input['id']].get(input['property'])) for input in spec['state']]
+            response = client.post('/_dash-update-component', json={
+                'output': spec['output'], 'outputs': outputs, 'inputs': inputs, 'state': state,
+                'changedPropIds': [trigger]})
+            if response.status_code != 200:
+                raise RuntimeError(f'update_simulation returned {response.status_code}')
+            store['data'] = response.get_json()['response']['simulation-data']['data']
+
+        # Size the session's market, then time parameter changes, which redraw every figure
+        update('sellers-slider.value')
+        yield result('callback', 'update_simulation', 'agents', agents,
+                     measure(lambda: update('production-slider.value'), seconds, repeats), 'requests/s')
+
+BENCHMARKS = {'engine': bench_engine, 'max_trades': bench_max_trades, 'mechanisms': bench_mechanisms,
+              'markets': bench_markets, 'ensemble': bench_ensemble, 'checkpoints': bench_checkpoints, 'figures': bench_figures,
+              'callback': bench_callback}
+
+def environment():
+    versions = {}
+    for module in ('numpy', 'numba', 'plotly', 'dash'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'kernel': DEFAULT_KERNEL, 'versions': versions}
+
+def compare(results, baseline, tolerance):
+    """
+    (key, baseline throughput, throughput, ratio, regressed) per case present in both
+    """
+    previous = {entry['key']: entry['throughput'] for entry in baseline['results']}
+    rows = []
+    for entry in results:
+        if entry['key'] in previous:
+            ratio = entry['throughput'] / previous[entry['key']]
+            rows.append((entry['key'], previous[entry['key']], entry['throughput'], ratio, ratio < 1 - tolerance))
+    return rows
+
+def plot_curves(results, path):
+    from plotly.subplots import make_subplots
+    import plotly.graph_objects as go
+
+    groups = [group for group in GROUPS if any(entry['group'] == group for entry in results)]
+    fig = make_subplots(rows=len(groups), cols=1, subplot_titles=groups, vertical_spacing=0.3 / len(groups))
+    for row, group in enumerate(groups, start=1):
+        entries = [entry for entry in results if entry['group'] == group]
+        for case in dict.fromkeys(entry['case'] for entry in entries):
+            points = [entry for entry in entries if entry['case'] == case]
+            fig.add_trace(go.Scatter(x=[entry['value'] for entry in points], y=[entry['throughput'] for entry in points],
+                                     mode='lines+markers', name=case), row=row, col=1)
+        fig.update_xaxes(type='log', title_text=entries[0]['parameter'], row=row, col=1)
+        fig.update_yaxes(type='log', title_text=entries[0]['unit'], row=row, col=1)
+    fig.update_layout(height=350 * len(groups), title='Throughput scaling')
+    # The page embeds plotly.js so it opens without a network connection
+    fig.write_html(path, include_plotlyjs=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--quick', action='store_true', help=f'cap the sizes at {QUICK_LIMITS}')
+    parser.add_argument('--seconds', type=float, default=0.5, help='minimum wall clock per repeat')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--plot', help='write the scaling curves as an HTML page')
+    parser.add_argument('--baseline', help='compare against these results and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='largest accepted drop in throughput, as a fraction of the baseline')
+    parser.add_argument('--save-baseline', help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    sizes = {'agents': AGENTS, 'max_trades': MAX_TRADES}
+    if args.quick:
+        sizes = {name: [value for value in values if value <= QUICK_LIMITS[name]] for name, values in sizes.items()}
+
+    np.random.seed(0)
+    results = []
+    print(f"{'case':<48} {'throughput':>14}")
+    for group in args.only:
+        for entry in BENCHMARKS[group](sizes, args.seconds, args.repeats):
+            print(f"{entry['key']:<48} {entry['throughput']:>14.2f} {entry['unit']}", flush=True)
+            results.append(entry)
+
+    report = {'version': RESULTS_VERSION, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'environment': environment(), 'seconds': args.seconds, 'repeats': args.repeats, 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(report, file, indent=1)
+    if args.plot:
+        plot_curves(results, args.plot)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['environment'] != report['environment']:
+            print('warning: the baseline was recorded in a different environment')
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\n{'case':<48} {'baseline':>12} {'now':>12} {'ratio':>7}")
+        for key, previous, throughput, ratio, regressed in rows:
+            print(f"{key:<48} {previous:>12.2f} {throughput:>12.2f} {ratio:>7.2f}{'  REGRESSED' if regressed else ''}")
+        compared = {row[0] for row in rows}
+        for key in sorted({entry['key'] for entry in results} - compared):
+            print(f'{key:<48} not in the baseline')
+        regressions = sum(row[4] for row in rows)
+        if regressions:
+            print(f'{regressions} of {len(rows)} cases regressed by more than {args.tolerance:.0%}')
+            sys.exit(1)
+        print(f'no regressions beyond {args.tolerance:.0%} in {len(rows)} cases')
+
+
+if __name__ == '__main__':
+    main()
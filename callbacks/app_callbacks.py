@@ -1,18 +1,36 @@
+import numbers 
+
 from dash import Input, Output, State, callback_context, callback, html 
+from dash.exceptions import PreventUpdate 
 import numpy as np 
 import dash 
 
-from components.simulation import run_simulation, update_simulation_parameters
-from components.figures import create_price_figure, create_stock_figure
-from layouts.main_layout import initialize_simulation_data
-from layouts.main_layout import initial_values
+from components.markets import initialize_markets, market_view, economy_markets
+from components.simulation import initial_values
+from components.figures import create_price_figure, create_stock_figure, patch_price_figure, patch_stock_figure
+from components.figures import create_price_histogram, create_stock_histogram, patch_price_histogram, patch_stock_histogram
+from components.figures import use_histograms, create_history_figure, patch_history_figure
+from components.sessions import default_session_store, new_session_id
+from components.runner import default_runners, MAX_SEEK_AHEAD
+from components.profiling import PROFILER
+from callbacks.stream import register_stream, push_updates
+from callbacks.profiling import register_profiling
+from layouts.main_layout import agents_to_slider, slider_to_agents, market_options, mechanism_options
 
 def register_callbacks(app):
+    # Agent arrays stay on the server between ticks; the browser only holds the session id 
+    sessions = default_session_store()
+    runners = default_runners(sessions)
+    register_stream(app, runners)
+    register_profiling(app)
+
     @callback(
         [Output('price-graph', 'figure'),
         Output('stock-graph', 'figure'),
+        Output('history-graph', 'figure'),
         Output('simulation-data', 'data'),
-        Output('interval-component', 'disabled')],
+        Output('interval-component', 'disabled'),
+        Output('seed-input', 'placeholder')],
         [Input('start-button', 'n_clicks'),
         Input('reset-button', 'n_clicks'), 
         Input('interval-component', 'n_intervals'), 
@@ -24,44 +42,123 @@ def register_callbacks(app):
         Input('producer-desired-stock-slider', 'value'),
         Input('consumer-desired-stock-slider', 'value'),
         Input('max-trades-slider', 'value'),
-        Input('market-price-slider', 'value')],
-        [State('simulation-data', 'data')]
+        Input('market-price-slider', 'value'),
+        Input('ticks-per-second-slider', 'value'),
+        Input('mechanism-radio', 'value'),
+        Input('markets-slider', 'value'),
+        Input('coupling-slider', 'value'),
+        Input('market-dropdown', 'value'),
+        Input('seek-button', 'n_clicks')],
+        [State('seed-input', 'value'),
+        State('seek-input', 'value'),
+        State('simulation-data', 'data')]
     )
-    def update_simulation(start, reset, n_intervals, sellers, buyers, production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades, slider_market_price, sim_data):
+    def update_simulation(start, reset, n_intervals, sellers, buyers, production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades, slider_market_price, ticks_per_second_exponent, mechanism, markets, coupling, market, seek, seed, seek_tick, store_data):
         ctx = callback_context
         triggered_id = ctx.triggered[0]['prop_id'].split('.')[0] 
-        
-        # Check which input triggered the callback 
-        if triggered_id == 'market-price-slider':
-            sim_data['market_price'] = slider_market_price
-        elif triggered_id in ['sellers-slider', 'buyers-slider']:
-            sim_data = initialize_simulation_data(sellers, buyers)
-        
-        if triggered_id == 'start-button': 
-            sim_data['running'] = True 
-        elif triggered_id == 'reset-button': 
-            sim_data = initialize_simulation_data(sellers, buyers) 
-            sim_data['running'] = False 
-            
-        # Update simulation parameters 
-        update_simulation_parameters(sim_data, production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades, sim_data['market_price']) 
-
-        # Run simulation  
-        if sim_data['running']: 
-            sim_data = run_simulation(sim_data)
-            disabled_interval = False
-        else:
-            disabled_interval = True
-
-        # Create figures
-        price_fig = create_price_figure(sim_data, sellers, buyers, sim_data['market_price'])
-        stock_fig = create_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock)
-
-        return price_fig, stock_fig, sim_data, disabled_interval 
+
+        # The agent sliders are on a log scale 
+        sellers = slider_to_agents(sellers) 
+        buyers = slider_to_agents(buyers) 
+        # Fewer markets when there are many agents in each, to bound the session's memory 
+        markets = economy_markets(markets, sellers, buyers) 
+
+        session_id = store_data.get('session_id') or new_session_id() 
+
+        def restore_or_initialize(): 
+            sim_data = sessions.get(session_id) 
+            if sim_data is None: 
+                # New or expired session 
+                sim_data = initialize_markets(markets, sellers, buyers) 
+                sim_data['running'] = store_data.get('running', False) 
+            return sim_data 
+
+        # The market is stepped by a background runner; this callback only sends it commands 
+        # and draws the latest snapshot it published 
+        with PROFILER.phase('callback.runner'): 
+            runners.evict() 
+            runner = runners.get(session_id, restore_or_initialize) 
+
+            if triggered_id == 'interval-component': 
+                snapshot = runner.snapshot() 
+                if snapshot.frame == store_data.get('frame'): 
+                    # Nothing new since the last frame drawn 
+                    raise PreventUpdate 
+            else: 
+                # Check which input triggered the callback 
+                if triggered_id == 'market-price-slider':
+                    runner.send('market_price', market_price=slider_market_price)
+                elif triggered_id in ['sellers-slider', 'buyers-slider', 'markets-slider', 'reset-button']:
+                    # A given seed reruns the same market, from the checkpoint cache when it holds the run; 
+                    # anything but a non-negative integer draws a fresh one 
+                    if not isinstance(seed, numbers.Integral) or seed < 0: 
+                        seed = None 
+                    runner.send('reset', sellers=sellers, buyers=buyers, markets=markets, seed=seed)
+                elif triggered_id == 'start-button': 
+                    runner.send('start')
+                elif triggered_id == 'seek-button' and seek_tick is not None: 
+                    # Replays from the nearest checkpoint, so any past tick is a short replay away; 
+                    # ticks ahead are computed, so only up to MAX_SEEK_AHEAD past the current one 
+                    iteration = int(runner.snapshot().state['iteration']) 
+                    runner.send('seek', tick=min(max(int(seek_tick), 0), iteration + MAX_SEEK_AHEAD))
+
+                # Update simulation parameters and speed: 10 ** exponent iterations per second 
+                runner.send('parameters', production=production, consumption=consumption, max_stock=max_stock,
+                            producer_desired_stock=producer_desired_stock, consumer_desired_stock=consumer_desired_stock,
+                            max_trades=max_trades, mechanism=mechanism)
+                runner.send('coupling', coupling=coupling)
+                runner.send('target_tps', target_tps=10 ** float(ticks_per_second_exponent))
+                runner.sync() 
+                snapshot = runner.snapshot() 
+
+        # An economy of several markets draws the one picked in the dropdown 
+        sim_data = market_view(snapshot.state, market) 
+        # With push updates the stream draws the frames and the interval stays off 
+        disabled_interval = push_updates() or not sim_data['running'] 
+
+        # Create figures: on interval ticks only the bars and market price line change, so send a 
+        # partial update; anything else rebuilds the static layout, axes and annotations. 
+        # Large populations are drawn as binned distributions instead of one bar per agent 
+        with PROFILER.phase('callback.figures'): 
+            if use_histograms(sellers, buyers): 
+                if triggered_id == 'interval-component': 
+                    price_fig = patch_price_histogram(sim_data, sim_data['market_price'])
+                    stock_fig = patch_stock_histogram(sim_data, max_stock, producer_desired_stock, consumer_desired_stock)
+                else: 
+                    price_fig = create_price_histogram(sim_data, sim_data['market_price'])
+                    stock_fig = create_stock_histogram(sim_data, max_stock, producer_desired_stock, consumer_desired_stock)
+            elif triggered_id == 'interval-component': 
+                price_fig = patch_price_figure(sim_data, sellers, buyers, sim_data['market_price'])
+                stock_fig = patch_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock)
+            else: 
+                price_fig = create_price_figure(sim_data, sellers, buyers, sim_data['market_price'])
+                stock_fig = create_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock)
+
+        # The history is downsampled to a bounded number of points however long the run 
+        with PROFILER.phase('callback.history_figure'): 
+            if triggered_id == 'interval-component': 
+                history_fig = patch_history_figure(sim_data.history)
+            else: 
+                history_fig = create_history_figure(sim_data.history)
+
+        store_data = {
+            'session_id': session_id,
+            'frame': snapshot.frame,
+            'market': market or 0,
+            'push': push_updates(),
+            'running': sim_data['running'],
+            'iteration': sim_data['iteration'],
+            'seed': sim_data['seed'],
+            'market_price': sim_data['market_price']
+        }
+
+        # The current run's seed, to type in and rerun it 
+        return price_fig, stock_fig, history_fig, store_data, disabled_interval, f"{sim_data['seed']}" 
 
     @callback(
         [Output('sellers-slider', 'disabled'),
-        Output('buyers-slider', 'disabled')],
+        Output('buyers-slider', 'disabled'),
+        Output('markets-slider', 'disabled')],
         [Input('start-button', 'n_clicks'),
         Input('reset-button', 'n_clicks')],
         [State('simulation-data', 'data')]
@@ -69,11 +166,11 @@ def register_callbacks(app):
     def toggle_sliders(start_clicks, reset_clicks, sim_data):
         # Check if the start button is clicked and the simulation is not running
         if start_clicks and not sim_data.get('running', False):
-            return True, True  
+            return True, True, True  
         elif reset_clicks:
-            return False, False 
+            return False, False, False 
 
-        return sim_data.get('running', False), sim_data.get('running', False) 
+        return (sim_data.get('running', False),) * 3 
 
     @callback(
         Output('start-button', 'disabled'),
@@ -105,7 +202,11 @@ def register_callbacks(app):
         Output('producer-desired-stock-slider', 'value'),
         Output('consumer-desired-stock-slider', 'value'),
         Output('max-stock-slider', 'value'),
-        Output('max-trades-slider', 'value')],
+        Output('max-trades-slider', 'value'),
+        Output('ticks-per-second-slider', 'value'),
+        Output('mechanism-radio', 'value'),
+        Output('markets-slider', 'value'),
+        Output('coupling-slider', 'value')],
         [Input('reset-button', 'n_clicks')],
         [State('simulation-data', 'data')]
     )
@@ -113,13 +214,53 @@ def register_callbacks(app):
         if reset_clicks:
             # Reset sliders to their initial values
             return (initial_values['market_price'], 
-                    initial_values['sellers'],
-                    initial_values['buyers'],
+                    agents_to_slider(initial_values['sellers']),
+                    agents_to_slider(initial_values['buyers']),
                     initial_values['production'],
                     initial_values['consumption'],
                     initial_values['producer_desired_stock'],
                     initial_values['consumer_desired_stock'],
                     initial_values['max_stock'],
-                    initial_values['max_trades'])
+                    initial_values['max_trades'],
+                    0,
+                    initial_values['mechanism'],
+                    initial_values['markets'],
+                    initial_values['coupling'])
         # Returning dash.no_update prevents the callback from firing if the reset button hasn't been clicked
-        return dash.no_update
\ No newline at end of file
+        return dash.no_update
+
+    @callback(
+        [Output('sellers-count', 'children'),
+        Output('buyers-count', 'children')],
+        [Input('sellers-slider', 'value'),
+        Input('buyers-slider', 'value')]
+    )
+    def show_agent_counts(sellers, buyers):
+        return slider_to_agents(sellers), slider_to_agents(buyers)
+
+    @callback(
+        [Output('market-dropdown', 'options'),
+        Output('market-dropdown', 'value')],
+        [Input('markets-slider', 'value'),
+        Input('sellers-slider', 'value'),
+        Input('buyers-slider', 'value')],
+        [State('market-dropdown', 'value')]
+    )
+    def update_market_options(markets, sellers, buyers, market):
+        # Only the goods actually simulated, which update_simulation caps by the agent counts 
+        markets = economy_markets(markets, slider_to_agents(sellers), slider_to_agents(buyers)) 
+        # Keep the market in view while it still exists 
+        return market_options(markets), market if market is not None and market < markets else 0
+
+    @callback(
+        [Output('mechanism-radio', 'options'),
+        Output('mechanism-radio', 'value', allow_duplicate=True)],
+        [Input('markets-slider', 'value')],
+        [State('mechanism-radio', 'value')],
+        prevent_initial_call=True
+    )
+    def restrict_mechanism(markets, mechanism):
+        # Several markets always pair at random, so show that instead of the order book 
+        if markets > 1 and mechanism != 'random':
+            return mechanism_options(markets), 'random'
+        return mechanism_options(markets), dash.no_update
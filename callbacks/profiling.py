@@ -0,0 +1,67 @@
+import time
+
+from dash import Input, Output, callback_context, html
+from flask import g, jsonify, request
+
+from components.profiling import PROFILER, PERCENTILES, DEBUG_PANEL
+
+# Only these addresses may read or toggle the profiler
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def profile_table(summary):
+    columns = ['phase', 'count', 'mean'] + [f'p{q}' for q in PERCENTILES]
+    header = html.Tr([html.Th(column) for column in columns])
+    rows = [html.Tr([html.Td(name), html.Td(phase['count'])] + [html.Td(f'{phase[column]:.3f}') for column in columns[2:]])
+            for name, phase in summary.items()]
+    return [html.Thead(header), html.Tbody(rows)]
+
+def register_profiling(app):
+    """
+    Time whole update_simulation requests, serve the profiler on /profile and drive the debug panel
+    """
+    server = app.server
+
+    @server.before_request
+    def start_request_timer():
+        if PROFILER.enabled:
+            g.profile_start = time.perf_counter()
+
+    @server.after_request
+    def stop_request_timer(response):
+        start = g.pop('profile_start', None)
+        if start is not None and request.path.endswith('/_dash-update-component'):
+            # Includes Dash's dispatch and the JSON serialization of the figures and the store
+            body = request.get_json(silent=True) or {}
+            if 'price-graph.figure' in body.get('output', ''):
+                PROFILER.record('request.update_simulation', time.perf_counter() - start)
+        return response
+
+    @server.route('/profile', methods=['GET', 'POST'])
+    def profile():
+        """
+        GET: the per-phase percentiles in milliseconds. POST with enabled=0/1 or reset=1 to change it.
+        """
+        if request.remote_addr not in LOCAL_ADDRESSES:
+            return jsonify(error='profiling is only available locally'), 403
+        if request.method == 'POST':
+            if 'enabled' in request.values:
+                PROFILER.enabled = request.values['enabled'] not in ('0', 'false')
+            if request.values.get('reset') not in (None, '0', 'false'):
+                PROFILER.reset()
+        return jsonify(enabled=PROFILER.enabled, phases=PROFILER.summary())
+
+    if not DEBUG_PANEL:
+        return
+
+    @app.callback(
+        Output('profile-table', 'children'),
+        [Input('profile-toggle', 'value'),
+        Input('profile-interval', 'n_intervals')]
+    )
+    def update_profile_panel(toggle, n_intervals):
+        # Only a click changes the profiler, so the interval does not undo POST /profile
+        triggered_id = callback_context.triggered[0]['prop_id'].split('.')[0]
+        if triggered_id == 'profile-toggle':
+            PROFILER.enabled = 'on' in (toggle or [])
+        return profile_table(PROFILER.summary())
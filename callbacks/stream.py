@@ -0,0 +1,67 @@
+import os
+import time
+
+from dash import Input, Output, ClientsideFunction
+from flask import Response, request
+
+from components.frames import encode_frame
+from components.profiling import PROFILER
+
+# 'push' streams frames to the browser over server-sent events, 'poll' keeps the interval callback
+LIVE_UPDATES = os.environ.get('LIVE_UPDATES', 'push')
+# Frames per second sent to each viewer at most; the runner publishes about 10 per second
+STREAM_RATE = float(os.environ.get('STREAM_RATE', 10))
+# The history graph is the largest part of a frame and changes slowly, send it at most this often (seconds)
+HISTORY_INTERVAL = 1.0
+# A comment line keeps idle connections from being closed by proxies (seconds)
+KEEPALIVE_INTERVAL = 15.0
+
+
+def push_updates():
+    return LIVE_UPDATES == 'push'
+
+def register_stream(app, runners):
+    """
+    Serve /stream/<session_id> from the app's Flask server. While the session's runner is alive
+    it sends every new snapshot as a frame, dropping the ones published in between when the
+    viewer is slower than the runner. The market query parameter picks the market of an economy.
+    """
+
+    @app.server.route('/stream/<session_id>')
+    def stream(session_id):
+        runner = runners.find(session_id)
+        if runner is None:
+            # 204 tells EventSource not to reconnect; the page opens a new stream once it starts a run
+            return Response(status=204)
+        market = request.args.get('market', 0, type=int)
+
+        def frames():
+            yield 'retry: 3000\n\n'
+            last_frame = None
+            last_history = last_sent = 0.0
+            while runner.is_alive():
+                snapshot = runner.snapshot()
+                now = time.monotonic()
+                if snapshot.frame != last_frame:
+                    history = now - last_history >= HISTORY_INTERVAL or not snapshot.state['running']
+                    with PROFILER.phase('stream.encode_frame'):
+                        data = encode_frame(snapshot, history, market)
+                    yield f'id: {snapshot.frame}\ndata: {data}\n\n'
+                    last_frame = snapshot.frame
+                    last_sent = now
+                    if history:
+                        last_history = now
+                elif now - last_sent >= KEEPALIVE_INTERVAL:
+                    yield ': keepalive\n\n'
+                    last_sent = now
+                time.sleep(1 / STREAM_RATE)
+
+        return Response(frames(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    # assets/stream.js opens the stream for the session in the store whenever a run starts
+    app.clientside_callback(
+        ClientsideFunction(namespace='stream', function_name='connect'),
+        Output('stream-status', 'children'),
+        Input('simulation-data', 'data')
+    )
@@ -0,0 +1,158 @@
+"""
+Continuous double auction: an alternative to pairing random willing agents at one global price.
+
+Every tick each agent that can trade arrives once, in random order, with an order for all it
+can trade: a seller offers its whole stock at its min_selling_price, a buyer bids for the room
+left below max_stock at its max_buying_price. An arriving order trades against the best resting
+orders on the other side of the book while the prices cross, at the resting order's price, and
+whatever is left rests in the book. The book is a pair of binary heaps keyed by price (bids
+negated), so each insert and match is O(log n) and a tick is O(agents log agents) however many
+units change hands. max_trades does not cap the auction.
+
+The market price becomes the price of the last trade of the tick. The agents' own price and
+stock updates are the same as with random pairing.
+
+The heaps live in arrays, so the same code runs compiled by Numba or, without it, as plain Python.
+"""
+import numpy as np
+
+from components.kernels import NUMBA_AVAILABLE, LazyKernel
+
+
+def _heap_push(keys, ids, n, key, agent):
+    """
+    Insert into the min-heap in the first n entries of keys and ids; returns the new size
+    """
+    i = n
+    while i > 0:
+        parent = (i - 1) // 2
+        if keys[parent] <= key:
+            break
+        keys[i] = keys[parent]
+        ids[i] = ids[parent]
+        i = parent
+    keys[i] = key
+    ids[i] = agent
+    return n + 1
+
+def _heap_pop(keys, ids, n):
+    """
+    Remove the smallest entry of the min-heap of size n; returns the new size
+    """
+    n -= 1
+    key = keys[n]
+    agent = ids[n]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= n:
+            break
+        if child + 1 < n and keys[child + 1] < keys[child]:
+            child += 1
+        if key <= keys[child]:
+            break
+        keys[i] = keys[child]
+        ids[i] = ids[child]
+        i = child
+    if n > 0:
+        keys[i] = key
+        ids[i] = agent
+    return n
+
+def _continuous_auction(arrivals, uniforms, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock,
+                        market_price, ask_keys, ask_ids, bid_keys, bid_ids):
+    """
+    Run one tick of the auction. arrivals orders the agents: values below the number of sellers
+    are sellers, the rest are buyers offset by it. It is filled with a random permutation first,
+    driven by uniforms (one per agent). The stocks are updated in place.
+
+    Returns the units traded, the price of the last trade (market_price without trades) and
+    the number of sellers and buyers left resting in the book.
+    """
+    sellers = len(min_selling_prices)
+    n_asks = 0
+    n_bids = 0
+    trades = 0
+    price = market_price
+    # Inside-out Fisher-Yates: the order only depends on the uniforms, not on the last tick's
+    for k in range(len(arrivals)):
+        other = int(uniforms[k] * (k + 1))
+        arrivals[k] = arrivals[other]
+        arrivals[other] = k
+
+    for k in range(len(arrivals)):
+        agent = arrivals[k]
+        if agent < sellers:
+            if goods_sellers[agent] <= 0:
+                continue
+            ask = min_selling_prices[agent]
+            while goods_sellers[agent] > 0 and n_bids > 0 and -bid_keys[0] >= ask:
+                buyer = bid_ids[0]
+                units = min(goods_sellers[agent], max_stock - goods_buyers[buyer])
+                goods_sellers[agent] -= units
+                goods_buyers[buyer] += units
+                trades += units
+                price = -bid_keys[0]
+                if goods_buyers[buyer] >= max_stock:
+                    n_bids = _heap_pop(bid_keys, bid_ids, n_bids)
+            if goods_sellers[agent] > 0:
+                n_asks = _heap_push(ask_keys, ask_ids, n_asks, ask, agent)
+        else:
+            agent -= sellers
+            if goods_buyers[agent] >= max_stock:
+                continue
+            bid = max_buying_prices[agent]
+            while goods_buyers[agent] < max_stock and n_asks > 0 and ask_keys[0] <= bid:
+                seller = ask_ids[0]
+                units = min(goods_sellers[seller], max_stock - goods_buyers[agent])
+                goods_sellers[seller] -= units
+                goods_buyers[agent] += units
+                trades += units
+                price = ask_keys[0]
+                if goods_sellers[seller] <= 0:
+                    n_asks = _heap_pop(ask_keys, ask_ids, n_asks)
+            if goods_buyers[agent] < max_stock:
+                n_bids = _heap_push(bid_keys, bid_ids, n_bids, -bid, agent)
+    return trades, price, n_asks, n_bids
+
+# The heaps are compiled first, so the compiled auction calls the compiled versions
+continuous_auction = (LazyKernel(_continuous_auction, calls=(LazyKernel(_heap_push), LazyKernel(_heap_pop)))
+                      if NUMBA_AVAILABLE else _continuous_auction)
+
+class OrderBook:
+    """
+    Heap arrays, the arrival order and its shuffling uniforms of an auction, reused by every tick
+    """
+    __slots__ = ('ask_keys', 'ask_ids', 'bid_keys', 'bid_ids', 'arrivals', 'uniforms')
+
+    def __init__(self, sellers, buyers):
+        self.ask_keys = np.empty(sellers, dtype=np.int64)
+        self.ask_ids = np.empty(sellers, dtype=np.int32)
+        self.bid_keys = np.empty(buyers, dtype=np.int64)
+        self.bid_ids = np.empty(buyers, dtype=np.int32)
+        self.arrivals = np.empty(sellers + buyers, dtype=np.int32)
+        self.uniforms = np.empty(sellers + buyers)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+def auction_trades(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock,
+                   book=None, rng=None):
+    """
+    One tick of the continuous double auction; book is an OrderBook to reuse. Draws the arrival
+    order from rng, a np.random.Generator, or from the global np.random stream when None.
+
+    Returns the units traded, the new market price and the resting seller and buyer counts.
+    """
+    if book is None:
+        book = OrderBook(len(goods_sellers), len(goods_buyers))
+    # The compiled shuffle is several times faster than Generator.shuffle
+    if rng is None:
+        book.uniforms[:] = np.random.random(len(book.uniforms))
+    else:
+        rng.random(out=book.uniforms)
+    trades, price, n_asks, n_bids = continuous_auction(
+        book.arrivals, book.uniforms, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock,
+        market_price, book.ask_keys, book.ask_ids, book.bid_keys, book.bid_ids)
+    return int(trades), int(price), int(n_asks), int(n_bids)
@@ -0,0 +1,284 @@
+"""
+Content-addressed checkpoints of runs, for seeking to any tick and for instant reruns.
+
+A run's state at a tick is fully determined by its starting state (agent arrays, scalars and
+generator state), the parameters it started with and every later parameter change with the
+tick it happened at. A RunTimeline keeps that history as a hash chain, its lineage, and keys
+checkpoints by (lineage, tick), so equal keys mean equal states whichever session computed
+them: a rerun of a configuration, or a second session with the same seed and slider moves,
+finds the checkpoints the first one stored.
+
+Checkpoints are taken every interval ticks and whenever the parameters change, and held in a
+CheckpointCache shared by the process, least recently used first out once over its byte
+budget. Each holds the ticks of history computed since the previous one, so reaching a cached
+checkpoint restores the state and its history instead of computing them. Seeking restores the
+nearest checkpoint at or before the tick and replays only the ticks after it.
+
+    timeline = RunTimeline(state, cache)
+    state, history = timeline.advance(state, 5000)
+    state = timeline.seek(state, 1234)
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from components.markets import run_steps
+
+# Budget for the checkpoints of every run in the process (bytes)
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+# Ticks between checkpoints
+DEFAULT_INTERVAL = 100
+# Parameters that change the course of a run; market_price joins them when it is set by hand
+RUN_PARAMETERS = ('production', 'consumption', 'max_stock', 'producer_desired_stock', 'consumer_desired_stock',
+                  'max_trades', 'mechanism', 'coupling')
+# Scalars a checkpoint leaves as they are when restored
+UNRESTORED = ('running',)
+
+
+def plain(value):
+    """
+    A JSON-friendly copy of a scalar or array parameter
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def run_parameters(state, market_price=False):
+    parameters = {key: plain(state[key]) for key in RUN_PARAMETERS if key in state}
+    if market_price:
+        parameters['market_price'] = plain(state['market_price'])
+    return parameters
+
+def state_digest(state):
+    """
+    Hash of everything a run continues from: agent arrays, scalars and generator state
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for key, value in sorted(state.to_dict().items()):
+        if key in UNRESTORED:
+            continue
+        digest.update(key.encode())
+        if isinstance(value, np.ndarray):
+            digest.update(f'{value.dtype.str}{value.shape}'.encode())
+            digest.update(np.ascontiguousarray(value).data)
+        else:
+            digest.update(repr(plain(value)).encode())
+    digest.update(json.dumps(state.rng.bit_generator.state, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def chain_digest(lineage, tick, parameters):
+    """
+    Lineage after the parameters changed at tick
+    """
+    return hashlib.blake2b(json.dumps([lineage, int(tick), parameters], sort_keys=True).encode(),
+                           digest_size=16).hexdigest()
+
+def concatenate_histories(histories):
+    """
+    One history of consecutive ones, or None without any ticks
+    """
+    histories = [history for history in histories if len(history['iteration'])]
+    if not histories:
+        return None
+    if len(histories) == 1:
+        return histories[0]
+    return {name: np.concatenate([history[name] for history in histories]) for name in histories[0]}
+
+class Checkpoint:
+    """
+    Copy of a state's arrays, scalars and generator state, plus the ticks of history that led to
+    it when they were computed in one go
+    """
+    __slots__ = ('values', 'rng_state', 'history', 'nbytes')
+
+    def __init__(self, state, history=None):
+        self.values = {key: value.copy() if isinstance(value, np.ndarray) else value
+                       for key, value in state.to_dict().items() if key not in UNRESTORED}
+        self.rng_state = state.rng.bit_generator.state
+        self.history = history
+        self.nbytes = sum(value.nbytes for value in self.values.values() if isinstance(value, np.ndarray))
+        if history is not None:
+            self.nbytes += sum(column.nbytes for column in history.values())
+
+    def restore(self, state):
+        """
+        Put the checkpoint's values into state, in place. The state must have the same shape.
+        """
+        for key, value in self.values.items():
+            state[key] = value.copy() if isinstance(value, np.ndarray) else value
+        state.rng.bit_generator.state = self.rng_state
+        return state
+
+class CheckpointCache:
+    """
+    Checkpoints keyed by (lineage, tick), least recently used first out once over max_bytes
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._checkpoints = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            checkpoint = self._checkpoints.get(key)
+            if checkpoint is not None:
+                self._checkpoints.move_to_end(key)
+            return checkpoint
+
+    def put(self, key, checkpoint):
+        if checkpoint.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._checkpoints.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._checkpoints[key] = checkpoint
+            self.nbytes += checkpoint.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._checkpoints.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._checkpoints
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+class RunTimeline:
+    """
+    Lineage and checkpoints of one run, from the state it started at. Parameter changes are
+    recorded with their tick, so seeking back and stepping forward again replays the same run;
+    a change made at an earlier tick than the last one recorded starts a new branch and forgets
+    the rest. Only the thread stepping the run uses it.
+    """
+
+    def __init__(self, state, cache=None, interval=DEFAULT_INTERVAL):
+        # Without a shared cache a run can still seek, replaying from where it started
+        self.cache = cache if cache is not None else CheckpointCache(0)
+        self.interval = interval
+        # Kept out of the cache, so it is never evicted
+        self.origin = Checkpoint(state)
+        self.origin_tick = int(state['iteration'])
+        parameters = run_parameters(state)
+        # (tick, lineage, parameters) from that tick on, in tick order
+        self.entries = [(self.origin_tick, chain_digest(state_digest(state), self.origin_tick, parameters), parameters)]
+        # History computed since the last checkpoint
+        self.segment = []
+
+    def _index(self, tick):
+        """
+        Index of the entry in force at tick, once the changes made at tick are applied
+        """
+        return max(index for index, entry in enumerate(self.entries) if entry[0] <= tick)
+
+    def _store(self, state, lineage):
+        history = concatenate_histories(self.segment)
+        self.cache.put((lineage, int(state['iteration'])), Checkpoint(state, history))
+        self.segment = []
+
+    def _apply(self, state, applied):
+        """
+        Apply the recorded changes at the state's tick after the entry at index applied
+        """
+        tick = int(state['iteration'])
+        index = applied
+        while index + 1 < len(self.entries) and self.entries[index + 1][0] == tick:
+            index += 1
+            for key, value in self.entries[index][2].items():
+                state[key] = np.asarray(value) if isinstance(value, list) else value
+        if index != applied and (self.entries[index][1], tick) not in self.cache:
+            self._store(state, self.entries[index][1])
+
+    def change(self, state, market_price=False):
+        """
+        Record a parameter change made at the current tick; market_price when it was set by hand
+        """
+        tick = int(state['iteration'])
+        index = self._index(tick)
+        parameters = run_parameters(state, market_price)
+        in_force = {key: value for key, value in self.entries[index][2].items() if key != 'market_price'}
+        if not market_price and parameters == in_force:
+            return
+        del self.entries[index + 1:]
+        lineage = chain_digest(self.entries[index][1], tick, parameters)
+        self.entries.append((tick, lineage, parameters))
+        self._store(state, lineage)
+
+    def advance(self, state, ticks):
+        """
+        Step the state by ticks, applying the recorded changes on the way and restoring cached
+        checkpoints instead of computing the ticks that lead to them. Returns the state and the
+        history of the ticks.
+        """
+        if ticks <= 0:
+            return run_steps(state, 0)
+        histories = []
+        while ticks > 0:
+            tick = int(state['iteration'])
+            index = self._index(tick)
+            lineage = self.entries[index][1]
+            boundary = (tick // self.interval + 1) * self.interval
+            steps = min(ticks, boundary - tick)
+            if index + 1 < len(self.entries):
+                steps = min(steps, self.entries[index + 1][0] - tick)
+            checkpoint = self.cache.get((lineage, boundary)) if steps == boundary - tick else None
+            if checkpoint is not None and checkpoint.history is not None:
+                checkpoint.restore(state)
+                history = checkpoint.history
+                # The checkpoint may hold ticks from before the ones asked for
+                first = np.searchsorted(history['iteration'], tick, side='right')
+                histories.append({name: column[first:] for name, column in history.items()})
+                self.segment = []
+            else:
+                state, history = run_steps(state, steps)
+                histories.append(history)
+                self.segment.append(history)
+                if int(state['iteration']) == boundary:
+                    self._store(state, lineage)
+            self._apply(state, index)
+            ticks -= steps
+        return state, concatenate_histories(histories)
+
+    def seek(self, state, tick):
+        """
+        Move the run to tick: forward by stepping, backward by restoring the nearest checkpoint
+        at or before it and replaying the rest. Ticks before the run started are out of reach.
+        The history loses the ticks after the checkpoint and gains the replayed ones.
+        """
+        tick = max(int(tick), self.origin_tick)
+        current = int(state['iteration'])
+        if tick < current:
+            # The origin holds the state before any change, even those made at its own tick
+            start, checkpoint, applied = self.origin_tick, self.origin, 0
+            boundary = tick // self.interval * self.interval
+            candidates = sorted({entry[0] for entry in self.entries if entry[0] <= tick} |
+                                set(range(boundary, self.origin_tick, -self.interval)), reverse=True)
+            for candidate in candidates:
+                index = self._index(candidate)
+                cached = self.cache.get((self.entries[index][1], candidate))
+                if cached is not None:
+                    start, checkpoint, applied = candidate, cached, index
+                    break
+            checkpoint.restore(state)
+            state.history.truncate(current - start)
+            self.segment = []
+            self._apply(state, applied)
+            current = start
+        state, history = self.advance(state, tick - current)
+        state.history.extend(history)
+        return state
+
+def default_checkpoint_cache():
+    """
+    Checkpoint cache configured from the environment: CHECKPOINT_MAX_BYTES sets the budget
+    """
+    return CheckpointCache(int(os.environ.get('CHECKPOINT_MAX_BYTES', DEFAULT_MAX_BYTES)))
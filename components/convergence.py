@@ -0,0 +1,189 @@
+"""
+Online detection of a settled market, for stopping runs early.
+
+Once a market has settled its price oscillates around the equilibrium and the stocks hover
+around their desired levels, or around whatever level production and consumption allow. A
+market that has not keeps moving its price the same way, a unit every tick. A
+ConvergenceDetector watches two per-tick aggregates from the history, the market price and
+the stock imbalance (total stock less the total desired stock, per agent), over a rolling
+window. The market counts as settled at the first tick where, over the
+whole window, both
+    vary little: their standard deviation is at most the tolerance, and
+    do not drift: the means of the newer and the older half of the window differ by at most
+    the tolerance, which catches slow trends a variance bound lets through.
+The equilibrium price is the mean price over that window, and the equilibrium tick the first
+tick of the window.
+
+Picking the tolerances: the price of a settled market still swings by a tenth or so of the
+agents' prices (a standard deviation of about 4.6 around 47 for the default configuration,
+whose agents start with prices up to 100), and one swing can last a hundred ticks or more. The
+price tolerance therefore defaults to PRICE_TOLERANCE_FRACTION of the price scale, the mean
+of the agents' starting prices, and the window to DEFAULT_WINDOW ticks, long enough that a
+swing does not pass for a trend. A market still running away drifts by half a window of
+units, far beyond either. Raise the price tolerance for noisier markets, lower it, or lengthen
+the window, to wait for calmer ones. The stock imbalance of a settled market varies by well
+under a unit per agent.
+
+Every tick updates running sums in O(1), whatever the window. The aggregates are integers, so
+the sums are exact however long the run.
+
+    detector = ConvergenceDetector.for_state(state)
+    state, history = run_to_equilibrium(state, 10000, detector)
+    detector.equilibrium_tick, detector.equilibrium_price
+"""
+import numpy as np
+
+from components.simulation import run_simulation_steps
+
+# Ticks the statistics are taken over
+DEFAULT_WINDOW = 500
+# Largest standard deviation and drift of the market price in a settled market, as a fraction
+# of the price scale, and its floor in price units
+PRICE_TOLERANCE_FRACTION = 0.1
+MIN_PRICE_TOLERANCE = 1.0
+# Largest standard deviation and drift of the stock imbalance per agent in a settled market
+DEFAULT_STOCK_TOLERANCE = 1.0
+# Ticks run between checks by run_to_equilibrium, which bounds the ticks run past convergence
+DEFAULT_BATCH = 100
+
+
+class RollingWindow:
+    """
+    Mean, variance and drift of the last window values, updated in O(1) per value
+    """
+    __slots__ = ('window', 'half', 'values', 'position', 'count', 'total', 'squares', 'newer')
+
+    def __init__(self, window):
+        if window < 2:
+            raise ValueError(f'window must be at least 2 ticks, got {window}')
+        self.window = window
+        self.half = window // 2
+        self.values = [0] * window
+        # Index the next value is written to
+        self.position = 0
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        # Sum of the newest half values
+        self.newer = 0
+
+    def push(self, value):
+        if self.count >= self.window:
+            oldest = self.values[self.position]
+            self.total -= oldest
+            self.squares -= oldest * oldest
+        if self.count >= self.half:
+            # Moves from the newer half to the older one
+            self.newer -= self.values[(self.position - self.half) % self.window]
+        self.values[self.position] = value
+        self.total += value
+        self.squares += value * value
+        self.newer += value
+        self.position = (self.position + 1) % self.window
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.window
+
+    @property
+    def mean(self):
+        return self.total / min(self.count, self.window)
+
+    @property
+    def variance(self):
+        size = min(self.count, self.window)
+        return (size * self.squares - self.total * self.total) / (size * size)
+
+    @property
+    def drift(self):
+        """
+        Mean of the newer half of a full window less the mean of the older half
+        """
+        return self.newer / self.half - (self.total - self.newer) / (self.window - self.half)
+
+class ConvergenceDetector:
+    """
+    Watches the market price and stock imbalance tick by tick and records when and at what
+    price the market settled. agents and desired_stock are the number of agents and their total
+    desired stock, which the imbalance is taken against. Without a price_tolerance it is
+    PRICE_TOLERANCE_FRACTION of price_scale, or MIN_PRICE_TOLERANCE if that is larger.
+    """
+
+    def __init__(self, agents, desired_stock, window=DEFAULT_WINDOW, price_tolerance=None,
+                 stock_tolerance=DEFAULT_STOCK_TOLERANCE, price_scale=0):
+        self.agents = max(int(agents), 1)
+        self.desired_stock = int(desired_stock)
+        if price_tolerance is None:
+            price_tolerance = max(PRICE_TOLERANCE_FRACTION * price_scale, MIN_PRICE_TOLERANCE)
+        self.price_tolerance = price_tolerance
+        self.stock_tolerance = stock_tolerance
+        self.prices = RollingWindow(window)
+        self.imbalances = RollingWindow(window)
+        self.equilibrium_tick = None
+        self.equilibrium_price = None
+
+    @classmethod
+    def for_state(cls, state, **options):
+        sellers = len(state['goods_sellers'])
+        buyers = len(state['goods_buyers'])
+        desired_stock = sellers * state['producer_desired_stock'] + buyers * state['consumer_desired_stock']
+        # The agents' prices set the scale the market price moves on
+        price_scale = ((int(state['min_selling_prices'].sum()) + int(state['max_buying_prices'].sum())) /
+                       max(sellers + buyers, 1))
+        return cls(sellers + buyers, desired_stock, price_scale=price_scale, **options)
+
+    @property
+    def converged(self):
+        return self.equilibrium_tick is not None
+
+    def _settled(self):
+        prices = self.prices
+        imbalances = self.imbalances
+        # Compared per agent
+        tolerance = self.stock_tolerance * self.agents
+        return (prices.variance <= self.price_tolerance ** 2 and abs(prices.drift) <= self.price_tolerance and
+                imbalances.variance <= tolerance ** 2 and abs(imbalances.drift) <= tolerance)
+
+    def update(self, tick, market_price, total_stock):
+        """
+        Take one tick's aggregates; returns whether the market has settled, now or before
+        """
+        if self.converged:
+            return True
+        self.prices.push(int(market_price))
+        self.imbalances.push(int(total_stock) - self.desired_stock)
+        if self.prices.full and self._settled():
+            self.equilibrium_tick = int(tick) - self.prices.window + 1
+            self.equilibrium_price = self.prices.mean
+            return True
+        return False
+
+    def feed(self, history):
+        """
+        Take the ticks of a history, stopping at the one the market settled at; returns whether it has
+        """
+        for tick, market_price, total_stock in zip(history['iteration'].tolist(), history['market_price'].tolist(),
+                                                   history['total_stock'].tolist()):
+            if self.update(tick, market_price, total_stock):
+                return True
+        return self.converged
+
+def run_to_equilibrium(state, ticks, detector, batch=DEFAULT_BATCH):
+    """
+    run_simulation_steps for up to ticks, stopping at the end of the batch in which the
+    detector finds the market settled. Returns the state and the history of the ticks run.
+    """
+    histories = []
+    remaining = ticks
+    while remaining > 0:
+        state, history = run_simulation_steps(state, min(batch, remaining))
+        histories.append(history)
+        remaining -= len(history['iteration'])
+        if detector.feed(history):
+            break
+    if not histories:
+        return run_simulation_steps(state, 0)
+    if len(histories) == 1:
+        return state, histories[0]
+    return state, {name: np.concatenate([history[name] for history in histories]) for name in histories[0]}
@@ -0,0 +1,278 @@
+import os
+
+import numpy as np
+
+from components.auction import OrderBook, auction_trades
+from components.kernels import NUMBA_AVAILABLE, match_trades, pack_willing_sellers, pack_willing_buyers, adjust_agent_prices
+from components.profiling import PROFILER
+
+# Trade matching kernel: 'numba' when Numba is importable, otherwise 'numpy'.
+# MARKET_KERNEL=numpy forces the NumPy path, which reproduces np.random.choice matching draw for draw.
+DEFAULT_KERNEL = os.environ.get('MARKET_KERNEL', 'numba' if NUMBA_AVAILABLE else 'numpy')
+
+# Market mechanisms: random pairing of willing agents at the market price, or a continuous
+# double auction through an order book (see components/auction.py)
+MECHANISMS = ('random', 'auction')
+DEFAULT_MECHANISM = 'random'
+
+
+class TickBuffers:
+    """
+    Scratch arrays reused by every tick, so a tick given buffers does not allocate
+    anything proportional to the number of agents. The compiled kernels only need the index
+    arrays; the masks, ranges and price adjustments of the NumPy path are allocated by
+    numpy_scratch on its first tick.
+    """
+    __slots__ = ('sellers', 'buyers', 'dtype', 'seller_indices', 'buyer_indices',
+                 'seller_mask', 'seller_flag', 'seller_range', 'seller_adjustment',
+                 'buyer_mask', 'buyer_flag', 'buyer_range', 'buyer_adjustment', 'uniforms', 'book')
+
+    def __init__(self, sellers, buyers, dtype=np.int32):
+        self.sellers = sellers
+        self.buyers = buyers
+        self.dtype = dtype
+        self.seller_indices = np.empty(sellers, dtype=np.int32)
+        self.buyer_indices = np.empty(buyers, dtype=np.int32)
+        self.seller_mask = self.seller_flag = self.seller_range = self.seller_adjustment = None
+        self.buyer_mask = self.buyer_flag = self.buyer_range = self.buyer_adjustment = None
+        # Uniforms of the compiled matching kernel, grown to the largest max_trades seen
+        self.uniforms = np.empty((0, 2))
+        # Order book of the auction mechanism, created on its first tick
+        self.book = None
+
+    @property
+    def nbytes(self):
+        values = [getattr(self, name) for name in self.__slots__]
+        arrays = sum(value.nbytes for value in values if isinstance(value, np.ndarray))
+        return arrays + (self.book.nbytes if self.book is not None else 0)
+
+    def numpy_scratch(self):
+        """
+        Allocate the arrays only the NumPy path uses, once; returns the buffers
+        """
+        if self.seller_mask is None:
+            self.seller_mask = np.empty(self.sellers, dtype=bool)
+            self.seller_flag = np.empty(self.sellers, dtype=bool)
+            self.seller_range = np.arange(self.sellers, dtype=np.int32)
+            self.seller_adjustment = np.empty(self.sellers, dtype=self.dtype)
+            self.buyer_mask = np.empty(self.buyers, dtype=bool)
+            self.buyer_flag = np.empty(self.buyers, dtype=bool)
+            self.buyer_range = np.arange(self.buyers, dtype=np.int32)
+            self.buyer_adjustment = np.empty(self.buyers, dtype=self.dtype)
+        return self
+
+    def order_book(self):
+        if self.book is None:
+            self.book = OrderBook(self.sellers, self.buyers)
+        return self.book
+
+def random_index(rng, n):
+    """
+    Uniform draw from range(n). rng is a np.random.Generator, or None for the global
+    np.random stream, which draws exactly what np.random.choice did.
+    """
+    if rng is None:
+        return np.random.randint(n)
+    return rng.integers(n)
+
+def trade_uniforms(rng, max_trades, buffers=None):
+    """
+    (max_trades, 2) uniforms picking the seller and buyer of each trade, written into the
+    buffers when given a Generator
+    """
+    if rng is None:
+        return np.random.random((max_trades, 2))
+    if buffers is None:
+        return rng.random((max_trades, 2))
+    if len(buffers.uniforms) < max_trades:
+        buffers.uniforms = np.empty((max_trades, 2))
+    return rng.random(out=buffers.uniforms[:max_trades])
+
+def willing_sellers(market_price, min_selling_prices, goods_sellers, buffers=None):
+    """
+    Indices of sellers that accept the market price and still have goods
+    """
+    if buffers is None:
+        return np.flatnonzero((market_price >= min_selling_prices) & (goods_sellers > 0))
+    if NUMBA_AVAILABLE:
+        # One compiled pass that allocates nothing
+        return buffers.seller_indices[:pack_willing_sellers(market_price, min_selling_prices, goods_sellers,
+                                                            buffers.seller_indices)]
+
+    buffers = buffers.numpy_scratch()
+    mask = np.less_equal(min_selling_prices, market_price, out=buffers.seller_mask)
+    np.logical_and(mask, np.greater(goods_sellers, 0, out=buffers.seller_flag), out=mask)
+    # np.compress builds a temporary index array internally
+    return np.compress(mask, buffers.seller_range, out=buffers.seller_indices[:np.count_nonzero(mask)])
+
+def willing_buyers(market_price, max_buying_prices, goods_buyers, max_stock, buffers=None):
+    """
+    Indices of buyers that accept the market price and still have room in stock
+    """
+    if buffers is None:
+        return np.flatnonzero((market_price <= max_buying_prices) & (goods_buyers < max_stock))
+    if NUMBA_AVAILABLE:
+        return buffers.buyer_indices[:pack_willing_buyers(market_price, max_buying_prices, goods_buyers, max_stock,
+                                                          buffers.buyer_indices)]
+
+    buffers = buffers.numpy_scratch()
+    mask = np.greater_equal(max_buying_prices, market_price, out=buffers.buyer_mask)
+    np.logical_and(mask, np.less(goods_buyers, max_stock, out=buffers.buyer_flag), out=mask)
+    return np.compress(mask, buffers.buyer_range, out=buffers.buyer_indices[:np.count_nonzero(mask)])
+
+def execute_trades(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock, max_trades,
+                   kernel=None, buffers=None, rng=None):
+    """
+    Execute up to max_trades random one-unit trades at the market price.
+
+    The willing sets are computed once and then kept up to date as agents drop out,
+    instead of rebuilding both masks on every trade. The NumPy path keeps them sorted, so on
+    the global stream a draw of np.random.randint(len(set)) picks the same agent as
+    np.random.choice(set) did. The 'numba' kernel runs the loop compiled, drawing its picks
+    from a block of uniforms and swap-removing agents that drop out, which makes a trade O(1).
+    Draws come from rng, a np.random.Generator, when given.
+
+    Returns the number of trades and the sizes of both willing sets as seen at the
+    start of the last attempted trade (these drive the market price adjustment).
+    """
+    sellers = willing_sellers(market_price, min_selling_prices, goods_sellers, buffers)
+    buyers = willing_buyers(market_price, max_buying_prices, goods_buyers, max_stock, buffers)
+    n_sellers = len(sellers)
+    n_buyers = len(buyers)
+
+    if (kernel or DEFAULT_KERNEL) == 'numba' and NUMBA_AVAILABLE:
+        return match_trades(sellers, n_sellers, buyers, n_buyers, goods_sellers, goods_buyers,
+                            max_stock, max_trades, trade_uniforms(rng, max_trades, buffers))
+
+    trades = 0
+    seen_sellers, seen_buyers = n_sellers, n_buyers
+    for _ in range(max_trades):
+        seen_sellers, seen_buyers = n_sellers, n_buyers
+        if n_sellers == 0 or n_buyers == 0:
+            break
+
+        i = random_index(rng, n_sellers)
+        j = random_index(rng, n_buyers)
+        seller = sellers[i]
+        buyer = buyers[j]
+
+        goods_sellers[seller] -= 1
+        goods_buyers[buyer] += 1
+        trades += 1
+
+        # Drop agents that are no longer willing, shifting the tail down to keep the order
+        if goods_sellers[seller] <= 0:
+            sellers[i:n_sellers - 1] = sellers[i + 1:n_sellers]
+            n_sellers -= 1
+        if goods_buyers[buyer] >= max_stock:
+            buyers[j:n_buyers - 1] = buyers[j + 1:n_buyers]
+            n_buyers -= 1
+
+    return trades, seen_sellers, seen_buyers
+
+def adjust_market_price(market_price, n_sellers, n_buyers):
+    """
+    Move the market price one step towards the side with more willing agents
+    """
+    return max(int(market_price + np.sign(n_buyers - n_sellers)), 1)
+
+def adjust_prices(min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                  max_stock, producer_desired_stock, consumer_desired_stock, buffers=None):
+    """
+    Adjust every agent's price by one step towards its desired stock, in place.
+    Sellers at the stock limit cut their price ten times as fast.
+    """
+    if buffers is None:
+        seller_adjustment = np.empty_like(goods_sellers)
+        buyer_adjustment = np.empty_like(goods_buyers)
+        at_max_stock = None
+    elif NUMBA_AVAILABLE:
+        adjust_agent_prices(min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                            max_stock, producer_desired_stock, consumer_desired_stock)
+        return
+    else:
+        buffers = buffers.numpy_scratch()
+        seller_adjustment = buffers.seller_adjustment
+        buyer_adjustment = buffers.buyer_adjustment
+        at_max_stock = buffers.seller_flag
+
+    # Stock above desired -> lower the selling price, stock below desired -> raise it
+    np.sign(np.subtract(goods_sellers, producer_desired_stock, out=seller_adjustment), out=seller_adjustment)
+    at_max_stock = np.greater_equal(goods_sellers, max_stock, out=at_max_stock)
+    np.multiply(seller_adjustment, 10, out=seller_adjustment, where=at_max_stock)
+    np.subtract(min_selling_prices, seller_adjustment, out=min_selling_prices)
+    np.maximum(min_selling_prices, 1, out=min_selling_prices)
+
+    # Less goods than desired -> raise the buying price, more goods -> lower it
+    np.sign(np.subtract(consumer_desired_stock, goods_buyers, out=buyer_adjustment), out=buyer_adjustment)
+    np.add(max_buying_prices, buyer_adjustment, out=max_buying_prices)
+    np.maximum(max_buying_prices, 0, out=max_buying_prices)
+
+def produce_and_consume(goods_sellers, goods_buyers, production, consumption, max_stock):
+    """
+    Sellers produce up to max_stock, buyers consume down to zero, in place
+    """
+    np.add(goods_sellers, production, out=goods_sellers)
+    np.minimum(goods_sellers, max_stock, out=goods_sellers)
+    np.subtract(goods_buyers, consumption, out=goods_buyers)
+    np.maximum(goods_buyers, 0, out=goods_buyers)
+
+def tick(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+         production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades,
+         kernel=None, buffers=None, rng=None, mechanism=None):
+    """
+    Advance the market by one iteration. The agent arrays are updated in place.
+
+    Returns the new market price, the number of trades executed and the willing
+    seller and buyer counts that moved the market price. With the 'auction' mechanism
+    the trades are units traded, the price is the last trade's and the counts are the
+    sellers and buyers left resting in the order book.
+    """
+    if (mechanism or DEFAULT_MECHANISM) == 'auction':
+        with PROFILER.phase('tick.auction'):
+            trades, market_price, n_sellers, n_buyers = auction_trades(
+                market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock,
+                buffers.order_book() if buffers is not None else None, rng)
+    else:
+        with PROFILER.phase('tick.match_trades'):
+            trades, n_sellers, n_buyers = execute_trades(market_price, min_selling_prices, max_buying_prices,
+                                                         goods_sellers, goods_buyers, max_stock, max_trades, kernel, buffers, rng)
+        market_price = adjust_market_price(market_price, n_sellers, n_buyers)
+
+    with PROFILER.phase('tick.adjust_prices'):
+        adjust_prices(min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                      max_stock, producer_desired_stock, consumer_desired_stock, buffers)
+    with PROFILER.phase('tick.produce_and_consume'):
+        produce_and_consume(goods_sellers, goods_buyers, production, consumption, max_stock)
+
+    return market_price, trades, n_sellers, n_buyers
+
+def run_ticks(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+              production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades, ticks,
+              kernel=None, buffers=None, rng=None, mechanism=None):
+    """
+    Advance the market by several iterations without leaving NumPy in between.
+
+    Returns the final market price and a history with, per tick, the market price after
+    the tick, the trades executed, the willing seller and buyer counts and the total stock.
+    """
+    history = {
+        'market_price': np.empty(ticks, dtype=np.int64),
+        'trades': np.empty(ticks, dtype=np.int64),
+        'willing_sellers': np.empty(ticks, dtype=np.int64),
+        'willing_buyers': np.empty(ticks, dtype=np.int64),
+        'total_stock': np.empty(ticks, dtype=np.int64)
+    }
+    for step in range(ticks):
+        market_price, trades, n_sellers, n_buyers = tick(
+            market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+            production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades,
+            kernel, buffers, rng, mechanism)
+        history['market_price'][step] = market_price
+        history['trades'][step] = trades
+        history['willing_sellers'][step] = n_sellers
+        history['willing_buyers'][step] = n_buyers
+        with PROFILER.phase('tick.total_stock'):
+            history['total_stock'][step] = goods_sellers.sum(dtype=np.int64) + goods_buyers.sum(dtype=np.int64)
+
+    return market_price, history
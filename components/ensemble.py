@@ -0,0 +1,162 @@
+import numpy as np
+
+from components.engine import adjust_prices, produce_and_consume
+from components.simulation import initial_values
+
+# Quantiles of the market price across replicas recorded every tick
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def replica_generators(replicas, seed=None):
+    """
+    One independent random stream per replica, all derived from a single seed
+    """
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(replicas)]
+
+def initialize_ensemble(replicas, sellers, buyers, seed=None):
+    """
+    Initialize many replicas of the market as (replicas, agents) arrays.
+    Each replica draws its initial prices from its own stream.
+    """
+    sellers = int(sellers)
+    buyers = int(buyers)
+    rngs = replica_generators(replicas, seed)
+    high = initial_values['market_price'] * 2
+
+    return {
+        'running': False,
+        'iteration': 0,
+        'seed': seed,
+        'rngs': rngs,
+        'market_price': np.full(replicas, initial_values['market_price'], dtype=np.int64),
+        'min_selling_prices': np.stack([rng.integers(1, high, sellers) for rng in rngs]),
+        'max_buying_prices': np.stack([rng.integers(1, high, buyers) for rng in rngs]),
+        'goods_sellers': np.full((replicas, sellers), initial_values['producer_desired_stock'], dtype=np.int64),
+        'goods_buyers': np.full((replicas, buyers), initial_values['consumer_desired_stock'], dtype=np.int64),
+        'production': initial_values['production'],
+        'consumption': initial_values['consumption']
+    }
+
+def packed_indices(mask):
+    """
+    For each row, the column indices where mask is True packed to the front of the row,
+    plus how many there are
+    """
+    counts = mask.sum(axis=1)
+    rows, cols = np.nonzero(mask)
+    # Position of each True within its row
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.arange(len(rows)) - starts[rows]
+    packed = np.zeros(mask.shape, dtype=np.int64)
+    packed[rows, positions] = cols
+    return packed, counts
+
+def ensemble_trades(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                    max_stock, max_trades, uniforms):
+    """
+    Execute up to max_trades random one-unit trades in every replica at once.
+
+    Each step of the loop runs one trade in every replica that still has a willing seller
+    and buyer, so a step costs O(replicas) rather than O(replicas x agents). The willing sets
+    are packed index rows; an agent that drops out is swap-removed from its row. uniforms has
+    shape (replicas, max_trades, 2) and picks the seller and buyer of each trade, so a replica's
+    trades only depend on its own stream.
+
+    Returns the trades per replica and the willing set sizes seen at the start of each
+    replica's last attempted trade.
+    """
+    replicas = len(market_price)
+    sellers, n_sellers = packed_indices((market_price[:, None] >= min_selling_prices) & (goods_sellers > 0))
+    buyers, n_buyers = packed_indices((market_price[:, None] <= max_buying_prices) & (goods_buyers < max_stock))
+
+    trades = np.zeros(replicas, dtype=np.int64)
+    seen_sellers = n_sellers.copy()
+    seen_buyers = n_buyers.copy()
+    rows = np.arange(replicas)
+    for step in range(max_trades):
+        seen_sellers[rows] = n_sellers[rows]
+        seen_buyers[rows] = n_buyers[rows]
+        rows = rows[(n_sellers[rows] > 0) & (n_buyers[rows] > 0)]
+        if len(rows) == 0:
+            break
+
+        i = (uniforms[rows, step, 0] * n_sellers[rows]).astype(np.int64)
+        j = (uniforms[rows, step, 1] * n_buyers[rows]).astype(np.int64)
+        seller = sellers[rows, i]
+        buyer = buyers[rows, j]
+
+        goods_sellers[rows, seller] -= 1
+        goods_buyers[rows, buyer] += 1
+        trades[rows] += 1
+
+        # Swap-remove agents that are no longer willing
+        out = goods_sellers[rows, seller] <= 0
+        out_rows = rows[out]
+        n_sellers[out_rows] -= 1
+        sellers[out_rows, i[out]] = sellers[out_rows, n_sellers[out_rows]]
+
+        out = goods_buyers[rows, buyer] >= max_stock
+        out_rows = rows[out]
+        n_buyers[out_rows] -= 1
+        buyers[out_rows, j[out]] = buyers[out_rows, n_buyers[out_rows]]
+
+    return trades, seen_sellers, seen_buyers
+
+def ensemble_tick(market_price, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                  production, consumption, max_stock, producer_desired_stock, consumer_desired_stock, max_trades, uniforms):
+    """
+    Advance every replica by one iteration. The agent arrays are updated in place. production
+    and consumption are scalars or per-replica columns of shape (replicas, 1).
+
+    Returns the new market prices, the trades executed and the willing seller and buyer
+    counts per replica.
+    """
+    trades, n_sellers, n_buyers = ensemble_trades(market_price, min_selling_prices, max_buying_prices,
+                                                  goods_sellers, goods_buyers, max_stock, max_trades, uniforms)
+    market_price = np.maximum(market_price + np.sign(n_buyers - n_sellers), 1)
+
+    # Same element-wise rules as a single market, applied to all replicas
+    adjust_prices(min_selling_prices, max_buying_prices, goods_sellers, goods_buyers,
+                  max_stock, producer_desired_stock, consumer_desired_stock)
+    produce_and_consume(goods_sellers, goods_buyers, production, consumption, max_stock)
+
+    return market_price, trades, n_sellers, n_buyers
+
+def run_ensemble(ensemble, ticks, quantiles=DEFAULT_QUANTILES):
+    """
+    Advance all replicas by several iterations. Returns the ensemble and per-tick aggregates
+    across replicas: mean, standard deviation and quantiles of the market price, and the
+    mean number of trades.
+    """
+    rngs = ensemble['rngs']
+    replicas = len(rngs)
+    max_trades = ensemble['max_trades']
+    market_price = np.broadcast_to(ensemble['market_price'], (replicas,)).astype(np.int64)
+
+    history = {
+        'iteration': np.arange(ensemble['iteration'] + 1, ensemble['iteration'] + ticks + 1),
+        'mean_market_price': np.empty(ticks),
+        'std_market_price': np.empty(ticks),
+        'quantiles': np.asarray(quantiles),
+        'market_price_quantiles': np.empty((ticks, len(quantiles))),
+        'mean_trades': np.empty(ticks)
+    }
+    uniforms = np.empty((replicas, max_trades, 2))
+    for step in range(ticks):
+        for replica, rng in enumerate(rngs):
+            rng.random(out=uniforms[replica])
+
+        market_price, trades, _, _ = ensemble_tick(
+            market_price, ensemble['min_selling_prices'], ensemble['max_buying_prices'],
+            ensemble['goods_sellers'], ensemble['goods_buyers'], ensemble['production'], ensemble['consumption'],
+            ensemble['max_stock'], ensemble['producer_desired_stock'], ensemble['consumer_desired_stock'],
+            max_trades, uniforms)
+
+        history['mean_market_price'][step] = market_price.mean()
+        history['std_market_price'][step] = market_price.std()
+        history['market_price_quantiles'][step] = np.quantile(market_price, quantiles)
+        history['mean_trades'][step] = trades.mean()
+
+    ensemble['market_price'] = market_price
+    ensemble['iteration'] += ticks
+    return ensemble, history
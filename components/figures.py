@@ -1,22 +1,61 @@
+from dash import Patch
 import plotly.graph_objs as go
 import numpy as np
 
+from components.history import downsample_minmax
+
+# Bar colors are sent as 0/1 and mapped through this scale, which keeps frames small
+GREEN_RED = dict(colorscale=[[0, 'red'], [1, 'green']], cmin=0, cmax=1)
+
+# Above this many sellers or buyers the figures show binned distributions instead of one bar per agent
+HISTOGRAM_THRESHOLD = 500
+HISTOGRAM_BINS = 50
+
+# Points drawn per series in the history graph, however long the run
+HISTORY_POINTS = 1000
+
+
+def price_bars(sim_data, sellers, buyers, market_price):
+    """
+    Bar heights and colors of the price figure, and its y-axis limit
+    """
+    min_selling_prices = np.asarray(sim_data['min_selling_prices'])[:sellers]
+    max_buying_prices = np.asarray(sim_data['max_buying_prices'])[:buyers]
+
+    seller_colors = (min_selling_prices < market_price).view(np.int8)
+    buyer_colors = (max_buying_prices > market_price).view(np.int8)
+
+    max_price = max(min_selling_prices.max(initial=0), max_buying_prices.max(initial=0), market_price)
+    y_axis_limit = max(max_price * 1.1, 100)  
+
+    return min_selling_prices, seller_colors, max_buying_prices, buyer_colors, y_axis_limit
+
+def stock_bars(sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock):
+    """
+    Bar heights and colors of the stock figure, and its y-axis limit
+    """
+    goods_sellers = np.asarray(sim_data['goods_sellers'])[:sellers]
+    goods_buyers = np.asarray(sim_data['goods_buyers'])[:buyers]
+
+    producer_supply_colors = (goods_sellers < producer_desired_stock).view(np.int8)
+    consumer_supply_colors = (goods_buyers < consumer_desired_stock).view(np.int8)
+
+    max_goods = max(goods_sellers.max(initial=0), goods_buyers.max(initial=0), max_stock, producer_desired_stock)
+    y_axis_limit = max(max_goods * 1.1, 100)  
+
+    return goods_sellers, producer_supply_colors, goods_buyers, consumer_supply_colors, y_axis_limit
 
 def create_price_figure(sim_data, sellers, buyers, market_price):
     sellers = int(sellers) 
     buyers = int(buyers) 
 
-    seller_colors = ['green' if price < market_price else 'red' for price in sim_data['min_selling_prices']]
-    buyer_colors = ['green' if price > market_price else 'red' for price in sim_data['max_buying_prices']]
+    min_selling_prices, seller_colors, max_buying_prices, buyer_colors, y_axis_limit = price_bars(sim_data, sellers, buyers, market_price)
 
-    seller_bar = go.Bar(x=np.arange(-sellers, 0), y=sim_data['min_selling_prices'][:sellers], name='Producer Min Selling Price', marker_color=seller_colors[:sellers])
-    buyer_bar = go.Bar(x=np.arange(1, buyers + 1), y=sim_data['max_buying_prices'][:buyers], name='Consumers Max Buying Price', marker_color=buyer_colors[:buyers])
+    seller_bar = go.Bar(x=np.arange(-sellers, 0), y=min_selling_prices, name='Producer Min Selling Price', marker=dict(color=seller_colors, **GREEN_RED))
+    buyer_bar = go.Bar(x=np.arange(1, buyers + 1), y=max_buying_prices, name='Consumers Max Buying Price', marker=dict(color=buyer_colors, **GREEN_RED))
 
     price_fig = go.Figure(data=[seller_bar, buyer_bar])
 
-    max_price = max(sim_data['min_selling_prices'] + sim_data['max_buying_prices'] + [market_price])
-    y_axis_limit = max(max_price * 1.1, 100)  
-
     price_fig.update_layout(
         title='Prices',
         yaxis_title='Price',
@@ -44,16 +83,13 @@ def create_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_s
     sellers = int(sellers)  
     buyers = int(buyers)   
 
-    producer_supply_colors = ['green' if stock < producer_desired_stock else 'red' for stock in sim_data['goods_sellers']]
-    consumer_supply_colors = ['green' if stock < consumer_desired_stock else 'red' for stock in sim_data['goods_buyers']]
+    goods_sellers, producer_supply_colors, goods_buyers, consumer_supply_colors, y_axis_limit = stock_bars(
+        sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock)
 
-    producer_bar = go.Bar(x=np.arange(-sellers, 0), y=sim_data['goods_sellers'][:sellers], name='Producer Supply', marker_color=producer_supply_colors[:sellers])
-    consumer_bar = go.Bar(x=np.arange(1, buyers + 1), y=sim_data['goods_buyers'][:buyers], name='Consumer Supply', marker_color=consumer_supply_colors[:buyers])
+    producer_bar = go.Bar(x=np.arange(-sellers, 0), y=goods_sellers, name='Producer Supply', marker=dict(color=producer_supply_colors, **GREEN_RED))
+    consumer_bar = go.Bar(x=np.arange(1, buyers + 1), y=goods_buyers, name='Consumer Supply', marker=dict(color=consumer_supply_colors, **GREEN_RED))
 
     stock_fig = go.Figure(data=[producer_bar, consumer_bar]) 
-    
-    max_goods = max(sim_data['goods_sellers'] + sim_data['goods_buyers'] + [max_stock, producer_desired_stock])
-    y_axis_limit = max(max_goods * 1.1, 100)  
 
 
     stock_fig.update_layout(
@@ -94,4 +130,218 @@ def create_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_s
         annotation_font_size=12  
     ) 
 
-    return stock_fig 
+    return stock_fig
+
+def patch_price_figure(sim_data, sellers, buyers, market_price):
+    """
+    Partial update for a figure built by create_price_figure: only the bar heights and
+    colors, the y-axis range and the market price line change between ticks.
+    """
+    min_selling_prices, seller_colors, max_buying_prices, buyer_colors, y_axis_limit = price_bars(sim_data, int(sellers), int(buyers), market_price)
+
+    price_patch = Patch()
+    price_patch['data'][0]['y'] = min_selling_prices
+    price_patch['data'][0]['marker']['color'] = seller_colors
+    price_patch['data'][1]['y'] = max_buying_prices
+    price_patch['data'][1]['marker']['color'] = buyer_colors
+    price_patch['layout']['yaxis']['range'] = [0, y_axis_limit]
+
+    # The market price line is the first shape and annotation added by add_hline
+    price_patch['layout']['shapes'][0]['y0'] = market_price
+    price_patch['layout']['shapes'][0]['y1'] = market_price
+    price_patch['layout']['annotations'][0]['y'] = market_price
+    price_patch['layout']['annotations'][0]['text'] = f"Market Price: {market_price}"
+    return price_patch
+
+def patch_stock_figure(sim_data, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock):
+    """
+    Partial update for a figure built by create_stock_figure: only the bar heights and
+    colors and the y-axis range change between ticks, the stock lines stay put.
+    """
+    goods_sellers, producer_supply_colors, goods_buyers, consumer_supply_colors, y_axis_limit = stock_bars(
+        sim_data, int(sellers), int(buyers), max_stock, producer_desired_stock, consumer_desired_stock)
+
+    stock_patch = Patch()
+    stock_patch['data'][0]['y'] = goods_sellers
+    stock_patch['data'][0]['marker']['color'] = producer_supply_colors
+    stock_patch['data'][1]['y'] = goods_buyers
+    stock_patch['data'][1]['marker']['color'] = consumer_supply_colors
+    stock_patch['layout']['yaxis']['range'] = [0, y_axis_limit]
+    return stock_patch
+
+def use_histograms(sellers, buyers):
+    return max(int(sellers), int(buyers)) > HISTOGRAM_THRESHOLD
+
+def split_histogram(values, split, bin_width, bins):
+    """
+    Counts per bin of the values where split is True and of those where it is False
+    """
+    index = np.minimum(values // bin_width, bins - 1)
+    counts = np.bincount(index * 2 + split, minlength=2 * bins).reshape(bins, 2)
+    return counts[:, 1], counts[:, 0]
+
+def price_histograms(sim_data, market_price, bins=HISTOGRAM_BINS):
+    """
+    Bin centers and width, per-bin counts of sellers and buyers below/above the market
+    price, and the y-axis limit of the price histogram
+    """
+    min_selling_prices = np.asarray(sim_data['min_selling_prices'])
+    max_buying_prices = np.asarray(sim_data['max_buying_prices'])
+
+    max_price = max(min_selling_prices.max(initial=0), max_buying_prices.max(initial=0), market_price)
+    y_axis_limit = max(max_price * 1.1, 100)
+    bin_width = int(np.ceil(y_axis_limit / bins))
+
+    seller_green, seller_red = split_histogram(min_selling_prices, min_selling_prices < market_price, bin_width, bins)
+    buyer_green, buyer_red = split_histogram(max_buying_prices, max_buying_prices > market_price, bin_width, bins)
+    centers = (np.arange(bins) + 0.5) * bin_width
+
+    return centers, bin_width, (seller_green, seller_red, buyer_green, buyer_red), y_axis_limit
+
+def stock_histograms(sim_data, max_stock, producer_desired_stock, consumer_desired_stock, bins=HISTOGRAM_BINS):
+    """
+    Bin centers and width, per-bin counts of sellers and buyers below/above their desired
+    stock, and the y-axis limit of the stock histogram
+    """
+    goods_sellers = np.asarray(sim_data['goods_sellers'])
+    goods_buyers = np.asarray(sim_data['goods_buyers'])
+
+    max_goods = max(goods_sellers.max(initial=0), goods_buyers.max(initial=0), max_stock, producer_desired_stock)
+    y_axis_limit = max(max_goods * 1.1, 100)
+    bin_width = int(np.ceil(y_axis_limit / bins))
+
+    seller_green, seller_red = split_histogram(goods_sellers, goods_sellers < producer_desired_stock, bin_width, bins)
+    buyer_green, buyer_red = split_histogram(goods_buyers, goods_buyers < consumer_desired_stock, bin_width, bins)
+    centers = (np.arange(bins) + 0.5) * bin_width
+
+    return centers, bin_width, (seller_green, seller_red, buyer_green, buyer_red), y_axis_limit
+
+def histogram_figure(title, yaxis_title, centers, bin_width, counts, names, y_axis_limit):
+    """
+    Back-to-back horizontal histograms sharing the y axis of the bar figures:
+    sellers extend to the left, buyers to the right, each split in green and red.
+    The payload only depends on the number of bins.
+    """
+    traces = []
+    for count, name, sign, color in zip(counts, names, (-1, -1, 1, 1), ('green', 'red', 'green', 'red')):
+        traces.append(go.Bar(y=centers, x=sign * count, width=bin_width, orientation='h', name=name, marker_color=color,
+                             customdata=count, hovertemplate='%{customdata} agents<extra>%{fullData.name}</extra>'))
+
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        title=title,
+        yaxis_title=yaxis_title,
+        barmode='relative',
+        bargap=0,
+        xaxis={'visible': True, 'title': 'Producers \u2190 Number of Agents \u2192 Consumers', 'zeroline': True, 'zerolinecolor': 'black',
+               'title_font': {'size': 12}, 'tickfont': {'size': 12, 'color': 'black'}},
+        showlegend=False,
+        plot_bgcolor='white',
+        yaxis=dict(showgrid=False, range=[0, y_axis_limit], title_font=dict(size=12)),
+        margin=dict(l=50, r=50, t=50, b=50),
+        font=dict(size=12),
+        title_x=0.5,
+        height = 250
+    )
+    return fig
+
+def create_price_histogram(sim_data, market_price):
+    centers, bin_width, counts, y_axis_limit = price_histograms(sim_data, market_price)
+    names = ('Producers Below Market Price', 'Producers Above Market Price', 'Consumers Above Market Price', 'Consumers Below Market Price')
+    price_fig = histogram_figure('Prices', 'Price', centers, bin_width, counts, names, y_axis_limit)
+
+    price_fig.add_hline(
+        y=market_price, line_dash="dot",
+        annotation_text=f"Market Price: {market_price}",
+        annotation_position="bottom right",
+        annotation_bgcolor='white',
+        annotation_font_size=12
+    )
+    return price_fig
+
+def create_stock_histogram(sim_data, max_stock, producer_desired_stock, consumer_desired_stock):
+    centers, bin_width, counts, y_axis_limit = stock_histograms(sim_data, max_stock, producer_desired_stock, consumer_desired_stock)
+    names = ('Producers Below Desired Stock', 'Producers Above Desired Stock', 'Consumers Below Desired Stock', 'Consumers Above Desired Stock')
+    stock_fig = histogram_figure('Number of Goods', 'Number of Goods', centers, bin_width, counts, names, y_axis_limit)
+
+    for y, text, position in ((max_stock, f"Max Stock: {max_stock}", "bottom right"),
+                              (consumer_desired_stock, f"Consumers' Desired Stock: {consumer_desired_stock}", "bottom right"),
+                              (producer_desired_stock, f"Producers' Desired Stock: {producer_desired_stock}", "bottom left")):
+        stock_fig.add_hline(
+            y=y, line_dash="dot",
+            annotation_text=text,
+            annotation_position=position,
+            annotation_bgcolor='white',
+            annotation_font_size=12
+        )
+    return stock_fig
+
+def patch_histogram(fig_patch, centers, bin_width, counts, y_axis_limit):
+    for trace, (count, sign) in enumerate(zip(counts, (-1, -1, 1, 1))):
+        fig_patch['data'][trace]['x'] = sign * count
+        fig_patch['data'][trace]['customdata'] = count
+        fig_patch['data'][trace]['y'] = centers
+        fig_patch['data'][trace]['width'] = bin_width
+    fig_patch['layout']['yaxis']['range'] = [0, y_axis_limit]
+    return fig_patch
+
+def patch_price_histogram(sim_data, market_price):
+    """
+    Partial update for a figure built by create_price_histogram
+    """
+    price_patch = patch_histogram(Patch(), *price_histograms(sim_data, market_price))
+    price_patch['layout']['shapes'][0]['y0'] = market_price
+    price_patch['layout']['shapes'][0]['y1'] = market_price
+    price_patch['layout']['annotations'][0]['y'] = market_price
+    price_patch['layout']['annotations'][0]['text'] = f"Market Price: {market_price}"
+    return price_patch
+
+def patch_stock_histogram(sim_data, max_stock, producer_desired_stock, consumer_desired_stock):
+    """
+    Partial update for a figure built by create_stock_histogram
+    """
+    return patch_histogram(Patch(), *stock_histograms(sim_data, max_stock, producer_desired_stock, consumer_desired_stock))
+
+def history_series(history, max_points=HISTORY_POINTS):
+    """
+    Market price and trades over the iterations, each downsampled to at most max_points
+    """
+    columns = history.to_dict()
+    price_x, price_y = downsample_minmax(columns['iteration'], columns['market_price'], max_points)
+    trades_x, trades_y = downsample_minmax(columns['iteration'], columns['trades'], max_points)
+    return price_x, price_y, trades_x, trades_y
+
+def create_history_figure(history, max_points=HISTORY_POINTS):
+    price_x, price_y, trades_x, trades_y = history_series(history, max_points)
+
+    price_line = go.Scattergl(x=price_x, y=price_y, mode='lines', name='Market Price', line=dict(color='black'))
+    trades_line = go.Scattergl(x=trades_x, y=trades_y, mode='lines', name='Trades Executed', line=dict(color='#008cba', width=1), yaxis='y2')
+
+    history_fig = go.Figure(data=[price_line, trades_line])
+    history_fig.update_layout(
+        title='History',
+        xaxis=dict(title='Iteration', title_font=dict(size=12)),
+        yaxis=dict(title='Market Price', showgrid=False, rangemode='tozero', title_font=dict(size=12)),
+        yaxis2=dict(title='Trades Executed', overlaying='y', side='right', showgrid=False, rangemode='tozero',
+                    title_font=dict(size=12, color='#008cba'), tickfont=dict(color='#008cba')),
+        showlegend=False,
+        plot_bgcolor='white',
+        margin=dict(l=50, r=50, t=50, b=50),
+        font=dict(size=12),
+        title_x=0.5,
+        height = 250
+    )
+    return history_fig
+
+def patch_history_figure(history, max_points=HISTORY_POINTS):
+    """
+    Partial update for a figure built by create_history_figure
+    """
+    price_x, price_y, trades_x, trades_y = history_series(history, max_points)
+
+    history_patch = Patch()
+    history_patch['data'][0]['x'] = price_x
+    history_patch['data'][0]['y'] = price_y
+    history_patch['data'][1]['x'] = trades_x
+    history_patch['data'][1]['y'] = trades_y
+    return history_patch
@@ -0,0 +1,83 @@
+"""
+Compact frames for the push channel.
+
+A frame holds the same partial figure updates that interval callbacks send, built from a
+runner snapshot. Numeric arrays travel as base64 little-endian typed arrays instead of JSON
+number lists, which the browser decodes straight into Int32Array and friends.
+"""
+import base64
+import json
+
+import numpy as np
+
+from components.figures import use_histograms, patch_history_figure
+from components.figures import patch_price_figure, patch_stock_figure, patch_price_histogram, patch_stock_histogram
+from components.markets import market_view
+
+# dtypes the browser has a typed array for
+TYPED_ARRAY_DTYPES = ('int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'float32', 'float64')
+
+
+def encode_array(array):
+    if array.dtype == np.bool_:
+        array = array.view(np.uint8)
+    elif array.dtype.kind in 'iu' and array.dtype.name not in TYPED_ARRAY_DTYPES:
+        # 64-bit integers, e.g. iterations, narrow to int32 when they fit
+        fits = array.size == 0 or (array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max)
+        array = array.astype(np.int32 if fits else np.float64)
+    elif array.dtype.name not in TYPED_ARRAY_DTYPES:
+        array = array.astype(np.float64)
+    data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+    return {'dtype': array.dtype.name, 'bdata': base64.b64encode(data).decode('ascii')}
+
+def encode_value(value):
+    """
+    Replace the arrays in a JSON-like value with encoded typed arrays
+    """
+    if isinstance(value, np.ndarray):
+        return encode_array(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    return value
+
+def frame_patches(state, history=True):
+    """
+    Partial updates of the graphs for the state, keyed by graph id
+    """
+    sellers = len(state['goods_sellers'])
+    buyers = len(state['goods_buyers'])
+    max_stock = state['max_stock']
+    producer_desired_stock = state['producer_desired_stock']
+    consumer_desired_stock = state['consumer_desired_stock']
+
+    if use_histograms(sellers, buyers):
+        price_patch = patch_price_histogram(state, state['market_price'])
+        stock_patch = patch_stock_histogram(state, max_stock, producer_desired_stock, consumer_desired_stock)
+    else:
+        price_patch = patch_price_figure(state, sellers, buyers, state['market_price'])
+        stock_patch = patch_stock_figure(state, sellers, buyers, max_stock, producer_desired_stock, consumer_desired_stock)
+
+    patches = {'price-graph': price_patch, 'stock-graph': stock_patch}
+    if history:
+        patches['history-graph'] = patch_history_figure(state.history)
+    return patches
+
+def encode_frame(snapshot, history=True, market=None):
+    """
+    One frame as a JSON string: the snapshot's frame number and scalars, and the operations
+    of every graph's partial update. market picks the market drawn from an economy.
+    """
+    state = market_view(snapshot.state, market)
+    frame = {
+        'frame': snapshot.frame,
+        'running': bool(state['running']),
+        'iteration': int(state['iteration']),
+        'market_price': int(state['market_price']),
+        'figures': {graph_id: encode_value(patch.to_plotly_json()['operations'])
+                    for graph_id, patch in frame_patches(state, history).items()}
+    }
+    return json.dumps(frame, separators=(',', ':'))
@@ -0,0 +1,228 @@
+import numpy as np
+
+# Per-tick aggregates kept in the history and their dtypes
+HISTORY_DTYPES = {
+    'iteration': np.int64,
+    'market_price': np.int32,
+    'trades': np.int32,
+    'willing_sellers': np.int32,
+    'willing_buyers': np.int32,
+    'total_stock': np.int64
+}
+
+# Ticks kept per session before the oldest are overwritten
+DEFAULT_CAPACITY = 100000
+# Fewest ticks kept per market of a multi-market history
+MIN_CAPACITY = 1000
+# Ticks allocated up front; the arrays double from there as ticks arrive, up to the capacity
+INITIAL_ROWS = 1024
+
+
+def history_capacity(markets=None):
+    """
+    Ticks kept for a history of several markets, so it takes about the memory of one market's
+    """
+    return max(DEFAULT_CAPACITY // (markets or 1), MIN_CAPACITY)
+
+
+class HistoryBuffer:
+    """
+    Ring buffer of per-tick aggregates. Appending is amortised O(1) per tick and memory grows
+    with the ticks held, doubling from INITIAL_ROWS, until it reaches capacity ticks; from then
+    on it stays fixed and the oldest ticks are overwritten. With markets, every column but the
+    iteration has one value per market and tick.
+    """
+    __slots__ = ('capacity', 'markets', 'size', 'end', 'total', 'written', 'generation', 'columns')
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, markets=None):
+        self.capacity = capacity
+        self.markets = markets
+        self.size = 0
+        # Index the next tick is written to
+        self.end = 0
+        # Ticks ever appended, including overwritten ones
+        self.total = 0
+        # Sequence numbers for readers on other threads (see HistoryView): the most ticks ever
+        # written or about to be, set before the rows are, so every tick below written - capacity
+        # is overwritten; and the number of truncations, after which ticks at and above the new
+        # total are written again
+        self.written = 0
+        self.generation = 0
+        self.columns = self._allocate(min(capacity, INITIAL_ROWS))
+
+    def _allocate(self, rows):
+        return {name: np.zeros(rows if self.markets is None or name == 'iteration' else (rows, self.markets),
+                               dtype=dtype)
+                for name, dtype in HISTORY_DTYPES.items()}
+
+    def _reserve(self, count):
+        """
+        Grow the arrays to hold count more ticks, up to the capacity. Until they reach it the
+        ring has never wrapped, so the ticks held are the first size rows.
+        """
+        rows = len(self.columns['iteration'])
+        if rows >= self.capacity or self.size + count <= rows:
+            return
+        columns = self._allocate(min(max(2 * rows, self.size + count), self.capacity))
+        for name, column in columns.items():
+            column[:self.size] = self.columns[name][:self.size]
+        # Replaced whole, so readers see the old arrays or the new ones
+        self.columns = columns
+
+    def append(self, **values):
+        self._reserve(1)
+        self.written = max(self.written, self.total + 1)
+        for name, column in self.columns.items():
+            column[self.end] = values[name]
+        self.end = (self.end + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.total += 1
+
+    def extend(self, history):
+        """
+        Append several ticks at once from a dict of equal-length arrays
+        """
+        count = len(history['iteration'])
+        self._reserve(count)
+        self.written = max(self.written, self.total + count)
+        # Only the newest capacity ticks can survive
+        skip = max(count - self.capacity, 0)
+        start = (self.end + skip) % self.capacity
+        positions = (start + np.arange(count - skip)) % self.capacity
+        for name, column in self.columns.items():
+            column[positions] = history[name][skip:]
+        self.end = (self.end + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.total += count
+
+    def truncate(self, count):
+        """
+        Drop the newest count ticks, so the next append follows the tick before them
+        """
+        count = min(count, self.size)
+        self.generation += 1
+        self.end = (self.end - count) % self.capacity
+        self.size -= count
+        self.total -= count
+
+    def column(self, name):
+        """
+        The column in tick order, oldest first. A view unless the buffer has wrapped.
+        """
+        column = self.columns[name]
+        start = (self.end - self.size) % self.capacity
+        if start + self.size <= self.capacity:
+            return column[start:start + self.size]
+        return np.concatenate((column[start:], column[:self.end]))
+
+    def view(self):
+        """
+        Read-only view of the ticks appended so far, for readers on other threads
+        """
+        return HistoryView(self, self.total)
+
+    def to_dict(self):
+        return {name: self.column(name) for name in self.columns}
+
+    @classmethod
+    def from_dict(cls, history, capacity=None):
+        # Two-dimensional columns hold several markets
+        markets = history['market_price'].shape[1] if history and np.ndim(history['market_price']) == 2 else None
+        buffer = cls(capacity or history_capacity(markets), markets)
+        if history and len(history['iteration']):
+            buffer.extend(history)
+        return buffer
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def __len__(self):
+        return self.size
+
+class HistoryView:
+    """
+    The ticks of a HistoryBuffer up to a given total, read without copying the buffer while its
+    owner keeps writing to it. Reads copy only ticks the buffer has finished writing and check
+    its sequence numbers once copied: ticks overwritten meanwhile are dropped from the front,
+    and a copy taken while the owner truncated is taken again. After a truncation (a seek back)
+    the view's ticks past the cut are the ones written since, up to the view's total.
+    """
+    __slots__ = ('buffer', 'total')
+
+    def __init__(self, buffer, total):
+        self.buffer = buffer
+        self.total = total
+
+    def _read(self, names):
+        buffer = self.buffer
+        while True:
+            generation = buffer.generation
+            # Ticks from total up are being written; read the total before the arrays, which
+            # are only replaced by bigger ones holding every tick below it
+            end = min(self.total, buffer.total)
+            columns = buffer.columns
+            first = min(max(buffer.written - buffer.capacity, 0), end)
+            positions = np.arange(first, end) % buffer.capacity
+            values = {name: columns[name][positions] for name in names}
+            if buffer.generation == generation:
+                break
+        # Drop what the owner overwrote while we were copying
+        lost = min(max(buffer.written - buffer.capacity - first, 0), end - first)
+        return {name: column[lost:] for name, column in values.items()}
+
+    def __len__(self):
+        buffer = self.buffer
+        end = min(self.total, buffer.total)
+        return max(end - max(buffer.written - buffer.capacity, 0), 0)
+
+    def column(self, name):
+        return self._read((name,))[name]
+
+    def to_dict(self):
+        return self._read(tuple(self.buffer.columns))
+
+class MarketHistory:
+    """
+    One market's ticks of a multi-market HistoryBuffer or HistoryView, with the same reads
+    """
+    __slots__ = ('history', 'market')
+
+    def __init__(self, history, market):
+        self.history = history
+        self.market = market
+
+    def __len__(self):
+        return len(self.history)
+
+    def _select(self, column):
+        return column if column.ndim == 1 else column[:, self.market]
+
+    def column(self, name):
+        return self._select(self.history.column(name))
+
+    def to_dict(self):
+        return {name: self._select(column) for name, column in self.history.to_dict().items()}
+
+def downsample_minmax(x, y, max_points):
+    """
+    Keep the minimum and maximum of y in each of max_points // 2 buckets, in x order.
+    Preserves spikes, which matters for an oscillating market price.
+    """
+    n = len(y)
+    if n <= max_points:
+        return x, y
+
+    buckets = max_points // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    # Equal-width buckets up to rounding: pad each to the widest and mask the padding
+    width = int(np.max(np.diff(edges)))
+    index = np.minimum(starts[:, None] + np.arange(width), n - 1)
+    valid = starts[:, None] + np.arange(width) < edges[1:, None]
+    values = y[index]
+    low = index[np.arange(buckets), np.argmin(np.where(valid, values, np.inf), axis=1)]
+    high = index[np.arange(buckets), np.argmax(np.where(valid, values, -np.inf), axis=1)]
+
+    keep = np.unique(np.concatenate((low, high)))
+    return x[keep], y[keep]
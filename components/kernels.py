@@ -0,0 +1,131 @@
+"""
+Compiled trade-matching kernel.
+
+The matching loop is sequential: every trade changes the stocks that decide who is willing
+to trade next. When Numba is importable the loop below is compiled; compiled code is cached
+on disk (next to this file, or under NUMBA_CACHE_DIR) so later processes, such as the app after
+a restart or sweep workers, load it instead of compiling again. Without Numba the engine keeps
+its NumPy path.
+
+Numba itself takes about a fifth of a second to import, so it is imported on the first call
+of a kernel rather than with this module: processes that never step a market, and the app
+until its first tick, go without it.
+"""
+import importlib.util
+import threading
+
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+# Reentrant: compiling a kernel compiles the kernels it calls
+_compile_lock = threading.RLock()
+
+
+class LazyKernel:
+    """
+    A function compiled with numba.njit(cache=True, nogil=True) on its first call. The kernels
+    it calls are listed in calls: they are compiled first and bound in its module in place of
+    their plain Python versions, as Numba resolves calls to compiled functions through globals.
+    """
+    __slots__ = ('function', 'calls', 'dispatcher')
+
+    def __init__(self, function, calls=()):
+        self.function = function
+        self.calls = calls
+        self.dispatcher = None
+
+    def compile(self):
+        with _compile_lock:
+            if self.dispatcher is None:
+                from numba import njit
+                for kernel in self.calls:
+                    self.function.__globals__[kernel.function.__name__] = kernel.compile()
+                self.dispatcher = njit(cache=True, nogil=True)(self.function)
+        return self.dispatcher
+
+    def __call__(self, *args):
+        return (self.dispatcher or self.compile())(*args)
+
+
+def _match_trades(sellers, n_sellers, buyers, n_buyers, goods_sellers, goods_buyers, max_stock, max_trades, uniforms):
+    """
+    Execute up to max_trades one-unit trades between the willing sellers and buyers.
+
+    sellers and buyers hold the indices of the willing agents in their first n_sellers and
+    n_buyers entries. An agent that stops being willing is swap-removed: the last member takes
+    its place, so a trade costs O(1) however many agents are willing. uniforms has shape
+    (max_trades, 2) and picks the seller and buyer of each trade.
+
+    Returns the number of trades and the willing set sizes seen at the start of the last
+    attempted trade.
+    """
+    trades = 0
+    seen_sellers = n_sellers
+    seen_buyers = n_buyers
+    for step in range(max_trades):
+        seen_sellers = n_sellers
+        seen_buyers = n_buyers
+        if n_sellers == 0 or n_buyers == 0:
+            break
+
+        i = int(uniforms[step, 0] * n_sellers)
+        j = int(uniforms[step, 1] * n_buyers)
+        seller = sellers[i]
+        buyer = buyers[j]
+
+        goods_sellers[seller] -= 1
+        goods_buyers[buyer] += 1
+        trades += 1
+
+        if goods_sellers[seller] <= 0:
+            n_sellers -= 1
+            sellers[i] = sellers[n_sellers]
+        if goods_buyers[buyer] >= max_stock:
+            n_buyers -= 1
+            buyers[j] = buyers[n_buyers]
+
+    return trades, seen_sellers, seen_buyers
+
+def _pack_willing_sellers(market_price, min_selling_prices, goods_sellers, out):
+    """
+    Write the indices of sellers that accept the market price and still have goods to the
+    front of out and return how many there are: the mask, its logical and and the packing
+    in a single pass over the agents
+    """
+    n = 0
+    for i in range(len(min_selling_prices)):
+        if min_selling_prices[i] <= market_price and goods_sellers[i] > 0:
+            out[n] = i
+            n += 1
+    return n
+
+def _pack_willing_buyers(market_price, max_buying_prices, goods_buyers, max_stock, out):
+    """
+    Buyer counterpart of _pack_willing_sellers: buyers that accept the market price and
+    still have room in stock
+    """
+    n = 0
+    for i in range(len(max_buying_prices)):
+        if max_buying_prices[i] >= market_price and goods_buyers[i] < max_stock:
+            out[n] = i
+            n += 1
+    return n
+
+def _adjust_prices(min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, max_stock,
+                   producer_desired_stock, consumer_desired_stock):
+    """
+    Move every agent's price one step towards its desired stock, in place, in one pass over
+    each side and without scratch arrays: engine.adjust_prices with the same results
+    """
+    for i in range(len(min_selling_prices)):
+        adjustment = (goods_sellers[i] > producer_desired_stock) - (goods_sellers[i] < producer_desired_stock)
+        if goods_sellers[i] >= max_stock:
+            adjustment *= 10
+        min_selling_prices[i] = max(min_selling_prices[i] - adjustment, 1)
+    for i in range(len(max_buying_prices)):
+        adjustment = (consumer_desired_stock > goods_buyers[i]) - (consumer_desired_stock < goods_buyers[i])
+        max_buying_prices[i] = max(max_buying_prices[i] + adjustment, 0)
+
+match_trades = LazyKernel(_match_trades) if NUMBA_AVAILABLE else None
+pack_willing_sellers = LazyKernel(_pack_willing_sellers) if NUMBA_AVAILABLE else None
+pack_willing_buyers = LazyKernel(_pack_willing_buyers) if NUMBA_AVAILABLE else None
+adjust_agent_prices = LazyKernel(_adjust_prices) if NUMBA_AVAILABLE else None
@@ -0,0 +1,221 @@
+"""
+Several markets, one per good, stepped together in one process.
+
+An Economy holds every market's agents as (markets, agents) arrays and one market price per
+market, and steps them all at once with the ensemble kernel (components/ensemble.py): one
+Python-level loop per tick whatever the number of goods, instead of one engine per market.
+Markets use random pairing; the order book mechanism only runs on a single market.
+
+Markets are coupled through substitution. With coupling c, buyers consume a good priced above
+the average price less, and one below it more, by c times the relative price gap, so demand
+moves to cheaper goods and prices are pulled together. A good priced far enough above the
+average would get a negative rate; it is consumed at zero instead and the other rates are
+scaled down to match, so total expected consumption is unchanged whatever the prices and
+c = 0 gives independent markets.
+
+For drawing, market(i) returns a MarketState-like view of one market, which the figures,
+frames and history figure take unchanged.
+"""
+import copy
+
+import numpy as np
+
+from components.ensemble import ensemble_tick
+from components.history import HistoryBuffer, MarketHistory, history_capacity
+from components.simulation import initial_values, run_simulation_steps
+from components.state import ARRAY_DTYPES, SCALAR_DEFAULTS, MarketState, initialize_state, new_seed
+
+# Scalars of an economy beyond those of a single market
+ECONOMY_DEFAULTS = {
+    'coupling': initial_values['coupling']
+}
+# Cap on markets x agents per side, which bounds the memory a session takes
+MAX_ECONOMY_AGENTS = 10 ** 6
+
+
+class Economy:
+    """
+    Several markets as (markets, agents) arrays with one market price each. Supports the same
+    item access as MarketState; market_price is an array, and setting it to a number sets
+    every market's price.
+    """
+    __slots__ = tuple(SCALAR_DEFAULTS) + tuple(ECONOMY_DEFAULTS) + tuple(ARRAY_DTYPES) + ('history', 'rng')
+
+    def __init__(self, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, rng=None, **scalars):
+        for key, value in {**SCALAR_DEFAULTS, **ECONOMY_DEFAULTS}.items():
+            setattr(self, key, scalars.get(key, value))
+        if self.seed is None:
+            self.seed = new_seed()
+        self.rng = rng if rng is not None else np.random.default_rng(self.seed)
+        for key, array in zip(ARRAY_DTYPES, (min_selling_prices, max_buying_prices, goods_sellers, goods_buyers)):
+            setattr(self, key, np.ascontiguousarray(array, dtype=ARRAY_DTYPES[key]))
+        self['market_price'] = self.market_price
+        self.history = HistoryBuffer(history_capacity(self.markets), self.markets)
+
+    @classmethod
+    def from_dict(cls, sim_data):
+        arrays = [sim_data[key] for key in ARRAY_DTYPES]
+        return cls(*arrays, rng=sim_data.get('rng'),
+                   **{key: sim_data[key] for key in (*SCALAR_DEFAULTS, *ECONOMY_DEFAULTS) if key in sim_data})
+
+    @property
+    def markets(self):
+        return len(self.goods_sellers)
+
+    def market(self, market):
+        """
+        Read-only MarketState view of one market, sharing its rows of the arrays
+        """
+        state = MarketState.__new__(MarketState)
+        for key in SCALAR_DEFAULTS:
+            setattr(state, key, getattr(self, key))
+        state.market_price = int(self.market_price[market])
+        for key in ARRAY_DTYPES:
+            setattr(state, key, getattr(self, key)[market])
+        state.buffers = None
+        state.history = MarketHistory(self.history, market)
+        state.rng = None
+        return state
+
+    def copy(self):
+        """
+        Copy of the arrays, scalars and generator state with a read-only view of the history,
+        for readers on other threads
+        """
+        economy = Economy.__new__(Economy)
+        for key in (*SCALAR_DEFAULTS, *ECONOMY_DEFAULTS):
+            setattr(economy, key, getattr(self, key))
+        economy.market_price = self.market_price.copy()
+        for key in ARRAY_DTYPES:
+            setattr(economy, key, getattr(self, key).copy())
+        economy.history = self.history.view()
+        economy.rng = copy.deepcopy(self.rng)
+        return economy
+
+    def to_dict(self):
+        """
+        The sim_data dict format; the arrays are shared, not copied
+        """
+        return {key: getattr(self, key) for key in (*SCALAR_DEFAULTS, *ECONOMY_DEFAULTS, *ARRAY_DTYPES)}
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key in ARRAY_DTYPES:
+            value = np.ascontiguousarray(value, dtype=ARRAY_DTYPES[key])
+        elif key == 'market_price':
+            value = np.array(np.broadcast_to(value, (self.markets,)), dtype=np.int64)
+        elif key not in self:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in SCALAR_DEFAULTS or key in ECONOMY_DEFAULTS or key in ARRAY_DTYPES
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, key).nbytes for key in ARRAY_DTYPES) + self.history.nbytes
+
+def initialize_markets(markets, sellers, buyers, seed=None):
+    """
+    A MarketState for one market, or an Economy of several with the given number of sellers
+    and buyers in each. Every market's initial prices are drawn like a single market's.
+    """
+    if markets <= 1:
+        return initialize_state(sellers, buyers, seed)
+    seed = new_seed() if seed is None else seed
+    rng = np.random.default_rng(seed)
+    high = SCALAR_DEFAULTS['market_price'] * 2
+    sellers = int(sellers)
+    buyers = int(buyers)
+    return Economy(
+        rng.integers(1, high, (markets, sellers)),
+        rng.integers(1, high, (markets, buyers)),
+        np.full((markets, sellers), SCALAR_DEFAULTS['producer_desired_stock']),
+        np.full((markets, buyers), SCALAR_DEFAULTS['consumer_desired_stock']),
+        rng=rng, seed=seed)
+
+def substitution_consumption(market_price, consumption, coupling, rng):
+    """
+    Units each market's buyers consume this tick, shape (markets, 1). Negative rates are
+    clipped to zero and the rest renormalised, so the rates always add up to consumption per
+    market. Fractional rates are rounded up or down at random, so small price gaps still shift
+    consumption on average.
+    """
+    mean = market_price.mean()
+    rates = np.maximum(consumption * (1 - coupling * (market_price - mean) / mean), 0)
+    total = rates.sum()
+    if total > 0:
+        rates *= consumption * len(rates) / total
+    return np.floor(rates + rng.random(len(rates))).astype(np.int64)[:, None]
+
+def run_markets(economy, ticks):
+    """
+    Advance every market by several iterations. Returns the economy and a history with the
+    iteration per tick and, per tick and market, the market price, trades, willing seller and
+    buyer counts and total stock.
+    """
+    markets = economy.markets
+    max_trades = economy['max_trades']
+    history = {
+        'iteration': np.arange(economy['iteration'] + 1, economy['iteration'] + ticks + 1),
+        'market_price': np.empty((ticks, markets), dtype=np.int64),
+        'trades': np.empty((ticks, markets), dtype=np.int64),
+        'willing_sellers': np.empty((ticks, markets), dtype=np.int64),
+        'willing_buyers': np.empty((ticks, markets), dtype=np.int64),
+        'total_stock': np.empty((ticks, markets), dtype=np.int64)
+    }
+    uniforms = np.empty((markets, max_trades, 2))
+    market_price = economy.market_price
+    for step in range(ticks):
+        economy.rng.random(out=uniforms)
+        if economy['coupling']:
+            consumption = substitution_consumption(market_price, economy['consumption'], economy['coupling'], economy.rng)
+        else:
+            consumption = economy['consumption']
+
+        market_price, trades, n_sellers, n_buyers = ensemble_tick(
+            market_price, economy.min_selling_prices, economy.max_buying_prices,
+            economy.goods_sellers, economy.goods_buyers, economy['production'], consumption,
+            economy['max_stock'], economy['producer_desired_stock'], economy['consumer_desired_stock'],
+            max_trades, uniforms)
+
+        history['market_price'][step] = market_price
+        history['trades'][step] = trades
+        history['willing_sellers'][step] = n_sellers
+        history['willing_buyers'][step] = n_buyers
+        history['total_stock'][step] = (economy.goods_sellers.sum(axis=1, dtype=np.int64)
+                                        + economy.goods_buyers.sum(axis=1, dtype=np.int64))
+
+    economy.market_price = market_price
+    economy['iteration'] += ticks
+    return economy, history
+
+def run_steps(state, ticks):
+    """
+    run_markets for an Economy, run_simulation_steps for a single market
+    """
+    if isinstance(state, Economy):
+        return run_markets(state, ticks)
+    return run_simulation_steps(state, ticks)
+
+def economy_markets(markets, sellers, buyers):
+    """
+    Markets simulated for the requested number: fewer when there are many agents in each, so
+    markets x agents per side stays within MAX_ECONOMY_AGENTS
+    """
+    return min(int(markets), max(MAX_ECONOMY_AGENTS // max(int(sellers), int(buyers), 1), 1))
+
+def market_view(state, market):
+    """
+    The market to draw: one market of an Economy, or the state itself
+    """
+    if isinstance(state, Economy):
+        return state.market(min(max(int(market or 0), 0), state.markets - 1))
+    return state
@@ -0,0 +1,99 @@
+"""
+Per-phase timing of the tick pipeline and the UI callbacks.
+
+Code wraps each stage in `with PROFILER.phase('name'):`. While profiling is off, phase returns
+one shared do-nothing context, so the cost is an attribute check and an empty with block.
+While it is on, every phase records its duration into a window of the most recent samples,
+summarized as percentiles. Timings from every thread, such as the runners, go to the same
+profiler.
+
+PROFILE_PHASES=1 turns profiling on at startup; the /profile endpoint and the debug panel
+(DEBUG_PANEL=1) turn it on and off at runtime.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Samples kept per phase
+DEFAULT_WINDOW = 2000
+PERCENTILES = (50, 90, 99)
+# Show the debug panel in the layout
+DEBUG_PANEL = os.environ.get('DEBUG_PANEL') == '1'
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class _Phase:
+    __slots__ = ('samples', 'start')
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # deque.append is atomic, so threads can record without a lock
+        self.samples.append(time.perf_counter() - self.start)
+        return False
+
+class Profiler:
+    """
+    Rolling per-phase durations, recorded only while enabled
+    """
+
+    def __init__(self, enabled=False, window=DEFAULT_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def _phase_samples(self, name):
+        samples = self._samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(name, deque(maxlen=self.window))
+        return samples
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self._phase_samples(name))
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self._phase_samples(name).append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def summary(self):
+        """
+        Sample count, mean and percentiles per phase, in milliseconds
+        """
+        with self._lock:
+            phases = list(self._samples.items())
+        summary = {}
+        for name, samples in sorted(phases):
+            values = np.array(samples) * 1000
+            if len(values) == 0:
+                continue
+            summary[name] = {'count': len(values), 'mean': float(values.mean()),
+                             **{f'p{q}': float(value) for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}}
+        return summary
+
+PROFILER = Profiler(enabled=os.environ.get('PROFILE_PHASES') == '1')
@@ -0,0 +1,233 @@
+"""
+Columnar recordings of runs on disk.
+
+A recording is a directory holding, for every recorded tick, the four agent arrays and the
+iteration and market price. Each column is split into chunks of chunk_ticks ticks, and each
+chunk is one .npy file of shape (chunk_ticks, agents) written through a memory map, so
+appending a tick copies the arrays straight into the page cache. When the writer knows how
+many ticks the run has, chunks hold no more than that, and on close the last chunk is cut
+down to the ticks it holds, so a short run takes the disk its ticks need. A small index.json
+lists the shape, dtypes, ticks written and rows of the last chunk; it is only updated once a
+chunk is complete and on close, so a reader never sees a half-written tick.
+
+RunReader maps the chunks read-only. Slicing a tick range inside one chunk, or an agent range
+with a slice, returns views of the files: nothing is read until it is touched. Analysis of
+10 ** 4 ticks of 10 ** 5 agents therefore only holds the pages it is working on:
+
+    run = RunReader('runs/baseline')
+    mean_stock = [chunk.mean(axis=1) for _, chunk in run.iter_chunks('goods_sellers')]
+"""
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from components.state import ARRAY_DTYPES
+
+INDEX_FILE = 'index.json'
+# Bumped when the layout below changes
+RECORDING_VERSION = 1
+# Chunks are sized to about this many bytes per column (bytes)
+DEFAULT_CHUNK_BYTES = 64 * 1024 ** 2
+
+# Per-tick scalars recorded next to the agent arrays
+SCALAR_COLUMNS = {
+    'iteration': np.int64,
+    'market_price': np.int32
+}
+
+
+def chunk_path(path, name, chunk):
+    return os.path.join(path, f'{name}.{chunk:06d}.npy')
+
+def column_widths(sellers, buyers):
+    """
+    Agents per column; scalar columns have no agent axis
+    """
+    widths = {name: sellers if name in ('min_selling_prices', 'goods_sellers') else buyers for name in ARRAY_DTYPES}
+    widths.update({name: None for name in SCALAR_COLUMNS})
+    return widths
+
+class RunWriter:
+    """
+    Appends ticks of a run to a recording directory. ticks is the length of the run when
+    known, which caps the chunk size.
+    """
+
+    def __init__(self, path, sellers, buyers, chunk_ticks=None, metadata=None, overwrite=False, ticks=None):
+        if os.path.exists(os.path.join(path, INDEX_FILE)) and not overwrite:
+            raise FileExistsError(f'{path} already holds a recording')
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in {**ARRAY_DTYPES, **SCALAR_COLUMNS}.items()}
+        self.widths = column_widths(int(sellers), int(buyers))
+        if chunk_ticks is None:
+            tick_bytes = max((width or 1) * self.dtypes[name].itemsize for name, width in self.widths.items())
+            chunk_ticks = max(DEFAULT_CHUNK_BYTES // tick_bytes, 1)
+            if ticks is not None:
+                chunk_ticks = min(chunk_ticks, max(int(ticks), 1))
+        self.chunk_ticks = int(chunk_ticks)
+        self.metadata = metadata or {}
+        self.ticks = 0
+        # Rows of the last chunk file
+        self.last_chunk_ticks = 0
+        self._chunk = None
+        self._columns = {}
+        self._write_index()
+
+    def _open_chunk(self, chunk):
+        self._close_chunk()
+        self._columns = {
+            name: np.lib.format.open_memmap(
+                chunk_path(self.path, name, chunk), mode='w+', dtype=self.dtypes[name],
+                shape=(self.chunk_ticks,) if width is None else (self.chunk_ticks, width))
+            for name, width in self.widths.items()
+        }
+        self._chunk = chunk
+
+    def _close_chunk(self):
+        for column in self._columns.values():
+            column.flush()
+        self._columns = {}
+        self._chunk = None
+
+    def _write_index(self):
+        index = {
+            'version': RECORDING_VERSION,
+            'ticks': self.ticks,
+            'chunk_ticks': self.chunk_ticks,
+            'last_chunk_ticks': self.last_chunk_ticks,
+            'columns': {name: {'dtype': self.dtypes[name].str, 'agents': width} for name, width in self.widths.items()},
+            'metadata': self.metadata
+        }
+        # Renamed into place, so readers see the old index or the new one
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(index, file)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+    def append(self, sim_data):
+        """
+        Record the current tick of sim_data, a MarketState or sim_data dict
+        """
+        chunk, row = divmod(self.ticks, self.chunk_ticks)
+        if chunk != self._chunk:
+            self._open_chunk(chunk)
+        for name, column in self._columns.items():
+            column[row] = sim_data[name]
+        self.ticks += 1
+        self.last_chunk_ticks = row + 1
+
+        if row == self.chunk_ticks - 1:
+            # Chunk complete: make it visible to readers
+            self._close_chunk()
+            self._write_index()
+
+    def flush(self):
+        for column in self._columns.values():
+            column.flush()
+        self._write_index()
+
+    def _trim_chunk(self):
+        """
+        Cut the open chunk's files down to the rows written
+        """
+        for name, column in self._columns.items():
+            column.flush()
+            path = chunk_path(self.path, name, self._chunk)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                np.lib.format.write_array(file, np.asarray(column[:self.last_chunk_ticks]))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        self._columns = {}
+        self._chunk = None
+
+    def close(self):
+        if self._chunk is not None and self.last_chunk_ticks < self.chunk_ticks:
+            self._trim_chunk()
+        self._close_chunk()
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class RunReader:
+    """
+    Read-only, memory-mapped access to a recording written by RunWriter
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as file:
+            index = json.load(file)
+        if index['version'] > RECORDING_VERSION:
+            raise ValueError(f"recording version {index['version']} is newer than {RECORDING_VERSION}")
+        self.ticks = index['ticks']
+        self.chunk_ticks = index['chunk_ticks']
+        # Rows of the last chunk file; recordings from before it was listed kept whole chunks
+        self.last_chunk_ticks = index.get('last_chunk_ticks', self.chunk_ticks)
+        self.columns = {name: column['agents'] for name, column in index['columns'].items()}
+        self.dtypes = {name: np.dtype(column['dtype']) for name, column in index['columns'].items()}
+        self.metadata = index['metadata']
+        self._maps = {}
+
+    def __len__(self):
+        return self.ticks
+
+    def _map(self, name, chunk):
+        key = (name, chunk)
+        if key not in self._maps:
+            self._maps[key] = np.load(chunk_path(self.path, name, chunk), mmap_mode='r')
+        return self._maps[key]
+
+    def _tick_range(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.ticks)
+        return start, max(stop, start)
+
+    def iter_chunks(self, name, start=0, stop=None, agents=None):
+        """
+        Yield (first tick, array) for the ticks [start, stop) of a column, one chunk at a time.
+        The arrays are views of the mapped files unless agents is an index array.
+        """
+        if name not in self.columns:
+            raise KeyError(name)
+        start, stop = self._tick_range(start, stop)
+        for chunk in range(start // self.chunk_ticks, math.ceil(stop / self.chunk_ticks)):
+            first = chunk * self.chunk_ticks
+            rows = slice(max(start - first, 0), min(stop - first, self.chunk_ticks))
+            values = self._map(name, chunk)[rows]
+            if agents is not None and self.columns[name] is not None:
+                values = values[:, agents]
+            yield first + rows.start, values
+
+    def column(self, name, start=0, stop=None, agents=None):
+        """
+        The ticks [start, stop) of a column, shape (ticks, agents). A view when the range lies
+        within one chunk and agents is None or a slice; otherwise only the selection is copied.
+        """
+        parts = [values for _, values in self.iter_chunks(name, start, stop, agents)]
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            width = self.columns[name]
+            return np.empty((0,) if width is None else (0, width), dtype=self.dtypes[name])
+        return np.concatenate(parts)
+
+    def tick(self, tick):
+        """
+        Every column at one tick, as views
+        """
+        if not -self.ticks <= tick < self.ticks:
+            raise IndexError(tick)
+        tick %= self.ticks
+        chunk, row = divmod(tick, self.chunk_ticks)
+        return {name: self._map(name, chunk)[row] for name in self.columns}
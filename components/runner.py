@@ -0,0 +1,284 @@
+"""
+Background simulation runners.
+
+Each session's market is stepped by its own daemon thread at a target number of ticks per
+second, independently of the browser. Callbacks send commands (start, reset, new parameters)
+to the runner and draw the latest snapshot it published. Only the newest snapshot is kept:
+when drawing is slower than the model, frames are dropped rather than queued, so a slow or
+throttled browser never slows the market down.
+
+Runners live in the process that started them and every request of a session must reach
+that process, so the app supports exactly one gunicorn worker serving requests from many
+threads; gunicorn.conf.py refuses to start with more. Their state is saved to the session
+store every few seconds and when they stop, so a restarted or evicted runner resumes where
+it left off.
+
+Runners step through a RunTimeline (components/checkpoints.py), which checkpoints the run into
+a cache shared by the process: a seek command moves the run to any tick by replaying from the
+nearest checkpoint, and a rerun of a configuration restores its checkpoints instead of
+computing them again.
+"""
+import logging
+import numbers
+import os
+import queue
+import threading
+import time
+
+from components.checkpoints import RunTimeline, default_checkpoint_cache
+from components.markets import initialize_markets
+from components.simulation import update_simulation_parameters
+from components.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+# Seconds between snapshots, which also bounds the ticks run in one batch
+PUBLISH_INTERVAL = 0.1
+# Seconds between saves to the session store while running
+PERSIST_INTERVAL = 5.0
+# Runners nobody has read from for this long are stopped (seconds)
+DEFAULT_MAX_IDLE = 5 * 60
+# How long a callback waits for its commands to be applied (seconds)
+SYNC_TIMEOUT = 5.0
+# Furthest a seek may go past the current tick. Seeking ahead computes every tick on the
+# runner's thread, about a second per 10 ** 4 ticks of 10 ** 4 agents each side
+MAX_SEEK_AHEAD = 10 ** 4
+
+
+class Snapshot:
+    """
+    A copy of the state as of one publish. frame counts publishes, so a reader can tell
+    whether anything changed since it last drew.
+    """
+    __slots__ = ('state', 'frame')
+
+    def __init__(self, state, frame):
+        self.state = state
+        self.frame = frame
+
+class SimulationRunner(threading.Thread):
+    """
+    Steps one session's MarketState or Economy at target_tps ticks per second while it is running.
+    Only this thread touches the state; everyone else sends commands and reads snapshots.
+    """
+
+    def __init__(self, session_id, state, store=None, target_tps=1.0, cache=None):
+        super().__init__(name=f'runner-{session_id}', daemon=True)
+        self.session_id = session_id
+        self.state = state
+        self.store = store
+        self.cache = cache
+        self.timeline = RunTimeline(state, cache)
+        self.target_tps = target_tps
+        self.commands = queue.Queue()
+        self.last_read = time.monotonic()
+        self._frame = 0
+        self._snapshot = None
+        self._stopped = False
+        # Whether the state changed since it was last saved to the store
+        self._dirty = False
+        self._publish()
+
+    def send(self, command, **arguments):
+        self.commands.put((command, arguments))
+
+    def sync(self, timeout=SYNC_TIMEOUT):
+        """
+        Wait until every command sent so far is applied and visible in the snapshot
+        """
+        applied = threading.Event()
+        self.send('sync', event=applied)
+        return applied.wait(timeout)
+
+    def snapshot(self):
+        self.last_read = time.monotonic()
+        return self._snapshot
+
+    def stop(self):
+        self.send('stop')
+
+    def _publish(self):
+        self._frame += 1
+        # Replacing the reference is atomic, readers never see a half-written snapshot
+        with PROFILER.phase('runner.publish'):
+            self._snapshot = Snapshot(self.state.copy(), self._frame)
+
+    def _persist(self):
+        # Called from this thread, so the state can't change while it is saved. Unchanged
+        # states aren't written again
+        if self.store is not None and self._dirty:
+            self.store.put(self.session_id, self.state)
+            self.store.flush(self.session_id)
+            self._dirty = False
+
+    def _persist_logged(self):
+        # A failed save (a full disk, say) is retried at the next interval instead of ending the runner
+        try:
+            with PROFILER.phase('runner.persist'):
+                self._persist()
+        except Exception:
+            logger.exception('runner %s: saving to the session store failed', self.session_id)
+
+    def _apply(self, command, arguments):
+        """
+        Apply one command. Returns the event of a sync command, to be set once published.
+        """
+        if command not in ('target_tps', 'stop', 'sync'):
+            self._dirty = True
+        if command == 'start':
+            self.state['running'] = True
+        elif command == 'reset':
+            # The same seed reruns the same market, which the checkpoint cache may already hold.
+            # Anything but a non-negative integer gets a fresh seed, like an empty seed input
+            seed = arguments.get('seed')
+            if not isinstance(seed, numbers.Integral) or seed < 0:
+                seed = None
+            self.state = initialize_markets(arguments.get('markets', 1), arguments['sellers'], arguments['buyers'],
+                                            seed=seed)
+            self.timeline = RunTimeline(self.state, self.cache)
+        elif command == 'parameters':
+            update_simulation_parameters(self.state, market_price=self.state['market_price'], **arguments)
+            self.timeline.change(self.state)
+        elif command == 'coupling':
+            # Only an economy of several markets has substitution between them
+            if 'coupling' in self.state:
+                self.state['coupling'] = arguments['coupling']
+                self.timeline.change(self.state)
+        elif command == 'market_price':
+            self.state['market_price'] = arguments['market_price']
+            self.timeline.change(self.state, market_price=True)
+        elif command == 'seek':
+            tick = arguments['tick']
+            # Out of range ticks are ignored: negative ones don't exist, far ones would stall the runner
+            if isinstance(tick, numbers.Integral) and 0 <= tick <= self.state['iteration'] + MAX_SEEK_AHEAD:
+                with PROFILER.phase('runner.seek'):
+                    self.state = self.timeline.seek(self.state, tick)
+        elif command == 'target_tps':
+            self.target_tps = arguments['target_tps']
+        elif command == 'stop':
+            self._stopped = True
+        elif command == 'sync':
+            return arguments['event']
+        return None
+
+    def _drain(self, block, timeout=None):
+        """
+        Apply every queued command, waiting up to timeout for the first one if block is set,
+        then publish the result
+        """
+        try:
+            commands = [self.commands.get(block=block, timeout=timeout)]
+        except queue.Empty:
+            return
+        while True:
+            try:
+                commands.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+
+        events = []
+        for command, arguments in commands:
+            try:
+                events.append(self._apply(command, arguments))
+            except Exception:
+                # A bad command is dropped; the session's runner carries on
+                logger.exception('runner %s: %s command failed', self.session_id, command)
+        self._publish()
+        for event in events:
+            if event is not None:
+                event.set()
+
+    def run(self):
+        last = time.perf_counter()
+        last_persist = last
+        owed = 0.0
+        while not self._stopped:
+            if not self.state['running']:
+                # Nothing to step until a command arrives, but save what the commands changed
+                self._drain(block=True, timeout=PERSIST_INTERVAL if self._dirty else None)
+                last = time.perf_counter()
+                owed = 0.0
+                if last - last_persist > PERSIST_INTERVAL:
+                    self._persist_logged()
+                    last_persist = last
+                continue
+
+            now = time.perf_counter()
+            owed += (now - last) * self.target_tps
+            last = now
+
+            # A batch covers about one publish interval. Ticks owed beyond one extra batch,
+            # when the machine can't keep up, are dropped instead of run as a burst later
+            batch = max(int(self.target_tps * PUBLISH_INTERVAL), 1)
+            owed = min(owed, 2 * batch)
+            ticks = min(int(owed), batch)
+            if ticks:
+                try:
+                    with PROFILER.phase('runner.batch'):
+                        self.state, history = self.timeline.advance(self.state, ticks)
+                        self.state.history.extend(history)
+                except Exception:
+                    # Pause rather than fail the same batch forever; start resumes the run
+                    logger.exception('runner %s: stepping failed, pausing', self.session_id)
+                    self.state['running'] = False
+                owed -= ticks
+                self._dirty = True
+                self._publish()
+
+            if now - last_persist > PERSIST_INTERVAL:
+                self._persist_logged()
+                last_persist = now
+
+            # Sleep until the next batch is due, waking early for commands
+            wait = min(max(batch - owed, 0) / self.target_tps, PUBLISH_INTERVAL)
+            self._drain(block=True, timeout=wait)
+
+        self._persist_logged()
+
+class SimulationRunners:
+    """
+    The runners of this process, keyed by session id
+    """
+
+    def __init__(self, store=None, max_idle=DEFAULT_MAX_IDLE, cache=None):
+        self.store = store
+        self.max_idle = max_idle
+        # Checkpoints shared by every runner, so sessions running the same configuration share them
+        self.cache = cache
+        self._runners = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id, create):
+        """
+        The session's runner, started on the state returned by create() if there is none
+        """
+        with self._lock:
+            runner = self._runners.get(session_id)
+            if runner is None or not runner.is_alive():
+                runner = SimulationRunner(session_id, create(), store=self.store, cache=self.cache)
+                runner.start()
+                self._runners[session_id] = runner
+            return runner
+
+    def find(self, session_id):
+        with self._lock:
+            runner = self._runners.get(session_id)
+            return runner if runner is not None and runner.is_alive() else None
+
+    def evict(self):
+        """
+        Stop runners whose browser has stopped reading from them
+        """
+        now = time.monotonic()
+        with self._lock:
+            for session_id, runner in list(self._runners.items()):
+                if now - runner.last_read > self.max_idle or not runner.is_alive():
+                    runner.stop()
+                    del self._runners[session_id]
+
+    def __len__(self):
+        return len(self._runners)
+
+def default_runners(store):
+    return SimulationRunners(store, max_idle=float(os.environ.get('RUNNER_MAX_IDLE', DEFAULT_MAX_IDLE)),
+                             cache=default_checkpoint_cache())
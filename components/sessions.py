@@ -0,0 +1,187 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from components.snapshots import save_snapshot, load_snapshot
+
+# Sessions idle for longer than this are dropped (seconds)
+DEFAULT_MAX_AGE = 60 * 60
+# Budget for the NumPy arrays kept in memory (bytes)
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+# How often the shared directory is swept for expired sessions (seconds)
+SWEEP_INTERVAL = 60
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+class SessionStore:
+    """
+    Server-side simulation state keyed by session id. Only the id travels to the browser.
+
+    Sessions' MarketState objects are kept in memory. put only updates memory and marks the
+    session dirty; when a directory is given, flush saves a dirty session there as a snapshot
+    (components.snapshots), so sessions survive a restart of the app and those evicted for
+    memory are reloaded on their next request. Runners put and flush at their persistence
+    interval, so a session is written at most that often and only when it changed. The app
+    runs a single worker (see gunicorn.conf.py): the directory persists sessions, it does not
+    share them between processes, whose runners would step the same session independently.
+    """
+
+    def __init__(self, directory=None, max_age=DEFAULT_MAX_AGE, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        # session_id -> (state, nbytes, dirty, last access), least recently used first
+        self._sessions = OrderedDict()
+        self._nbytes = 0
+        self._last_sweep = 0.0
+        self._lock = threading.RLock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f'{session_id}.npz')
+
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._nbytes -= entry[1]
+
+    def get(self, session_id):
+        """
+        Return the session's MarketState, or None if it is unknown or has expired
+        """
+        if not session_id:
+            return None
+        with self._lock:
+            now = time.time()
+            entry = self._sessions.get(session_id)
+
+            if entry is not None:
+                sim_data, nbytes, dirty, last_access = entry
+                if now - last_access > self.max_age:
+                    self.delete(session_id)
+                    return None
+            elif self.directory is not None:
+                # Evicted for memory, or saved by an earlier run of the app
+                try:
+                    expired = now - os.stat(self._path(session_id)).st_mtime > self.max_age
+                except FileNotFoundError:
+                    return None
+                if expired:
+                    self.delete(session_id)
+                    return None
+                sim_data = self._load(session_id)
+                if sim_data is None:
+                    return None
+                nbytes, dirty = sim_data.nbytes, False
+                self._nbytes += nbytes
+            else:
+                return None
+
+            self._sessions[session_id] = (sim_data, nbytes, dirty, now)
+            self._sessions.move_to_end(session_id)
+            return sim_data
+
+    def put(self, session_id, sim_data):
+        """
+        Store the session's MarketState in memory, to be saved by the next flush, and evict
+        idle sessions if needed
+        """
+        with self._lock:
+            now = time.time()
+            self._drop(session_id)
+            nbytes = sim_data.nbytes
+            self._sessions[session_id] = (sim_data, nbytes, self.directory is not None, now)
+            self._nbytes += nbytes
+            self.evict(now)
+
+    def flush(self, session_id):
+        """
+        Save the session to the directory if it changed since it was last saved. Call it from
+        the thread that steps the session, so the state can't change while it is saved.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or not entry[2]:
+                return False
+        # Saved outside the lock, so other sessions aren't held up by the write. Renamed into
+        # place, so readers never see a partial session
+        save_snapshot(self._path(session_id), entry[0])
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None and current[0] is entry[0]:
+                self._sessions[session_id] = current[:2] + (False,) + current[3:]
+        return True
+
+    def delete(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+            if self.directory is not None:
+                try:
+                    os.remove(self._path(session_id))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self, now=None):
+        """
+        Drop sessions idle for longer than max_age, then the least recently used ones
+        until the in-memory arrays fit in max_bytes. Sessions not flushed yet stay in memory
+        until they are; with a directory, those evicted for memory stay on disk and are
+        reloaded on their next request.
+        """
+        with self._lock:
+            now = time.time() if now is None else now
+
+            for session_id, (_, _, _, last_access) in list(self._sessions.items()):
+                if now - last_access <= self.max_age:
+                    break
+                self.delete(session_id)
+
+            for session_id, (_, _, dirty, _) in list(self._sessions.items())[:-1]:
+                if self._nbytes <= self.max_bytes:
+                    break
+                if not dirty:
+                    self._drop(session_id)
+
+            if self.directory is not None and now - self._last_sweep > SWEEP_INTERVAL:
+                self._last_sweep = now
+                for entry in os.scandir(self.directory):
+                    if not entry.name.endswith('.npz'):
+                        continue
+                    session_id = entry.name[:-len('.npz')]
+                    # Sessions in memory expire by their last access instead
+                    if session_id in self._sessions:
+                        continue
+                    try:
+                        expired = now - entry.stat().st_mtime > self.max_age
+                    except FileNotFoundError:
+                        continue
+                    if expired:
+                        self.delete(session_id)
+
+    def _load(self, session_id):
+        try:
+            return load_snapshot(self._path(session_id))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+    def __len__(self):
+        return len(self._sessions)
+
+def default_session_store():
+    """
+    Session store configured from the environment. SESSION_DIR points the shared backend
+    at a directory (defaults to one under the system temp dir); set it to an empty string
+    to keep sessions in memory only, so they are lost when the app restarts.
+    """
+    directory = os.environ.get('SESSION_DIR', os.path.join(tempfile.gettempdir(), 'market-simulation-sessions'))
+    return SessionStore(
+        directory=directory or None,
+        max_age=float(os.environ.get('SESSION_MAX_AGE', DEFAULT_MAX_AGE)),
+        max_bytes=int(os.environ.get('SESSION_MAX_BYTES', DEFAULT_MAX_BYTES))
+    )
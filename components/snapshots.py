@@ -0,0 +1,85 @@
+"""
+Binary snapshots of a run.
+
+A snapshot is an uncompressed .npz holding everything needed to continue a run exactly where
+it stopped: the agent arrays, the scalars, the per-tick history and the state of the run's
+random generator. Loading one and stepping it draws the same numbers the original run would
+have, so a long run can be saved at any tick and resumed, or branched into several runs with
+different parameters, without replaying it from tick 0.
+
+    state = initialize_state(1000, 1000, seed=42)
+    state, _ = run_simulation_steps(state, 100000)
+    save_snapshot('tick-100000.npz', state)
+
+    branch = load_snapshot('tick-100000.npz')
+    branch['production'] = 2
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from components.history import HistoryBuffer
+from components.markets import Economy
+from components.state import MarketState, ARRAY_DTYPES
+
+# Bumped when the layout below changes
+SNAPSHOT_VERSION = 1
+
+
+def generator_state(rng):
+    return json.dumps(rng.bit_generator.state)
+
+def restore_generator(state):
+    """
+    Generator continuing from a state written by generator_state
+    """
+    state = json.loads(state)
+    bit_generator = getattr(np.random, state['bit_generator'])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+def write_snapshot(file, state):
+    """
+    Write the MarketState or Economy to a path or open binary file
+    """
+    arrays = {key: np.asarray(value) for key, value in state.to_dict().items()}
+    arrays.update({f'history_{name}': column for name, column in state.history.to_dict().items()})
+    arrays['rng_state'] = np.array(generator_state(state.rng))
+    arrays['snapshot_version'] = np.array(SNAPSHOT_VERSION)
+    np.savez(file, **arrays)
+
+def read_snapshot(file):
+    """
+    The MarketState or Economy in a path or open binary file written by write_snapshot
+    """
+    with np.load(file) as data:
+        if int(data.get('snapshot_version', 0)) > SNAPSHOT_VERSION:
+            raise ValueError(f"snapshot version {int(data['snapshot_version'])} is newer than {SNAPSHOT_VERSION}")
+        rng = restore_generator(data['rng_state'].item()) if 'rng_state' in data.files else None
+        scalars = {key: data[key] if key in ARRAY_DTYPES or data[key].ndim else data[key].item() for key in data.files
+                   if not key.startswith('history_') and key not in ('rng_state', 'snapshot_version')}
+        # An economy has one market price per market
+        state_class = Economy if np.ndim(scalars['market_price']) else MarketState
+        state = state_class.from_dict(dict(scalars, rng=rng))
+        state.history = HistoryBuffer.from_dict({key[len('history_'):]: data[key]
+                                                 for key in data.files if key.startswith('history_')})
+    return state
+
+def save_snapshot(path, state):
+    """
+    Write a snapshot to path atomically: readers see the old file or the new one, never
+    a partial write
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write_snapshot(file, state)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def load_snapshot(path):
+    return read_snapshot(path)
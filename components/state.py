@@ -0,0 +1,123 @@
+import copy
+
+import numpy as np
+
+from components.engine import TickBuffers
+from components.history import HistoryBuffer
+from components.simulation import initial_values, initialize_simulation_data
+
+# Agent arrays and their fixed dtype; prices and stocks stay far below 2 ** 31
+ARRAY_DTYPES = {
+    'min_selling_prices': np.int32,
+    'max_buying_prices': np.int32,
+    'goods_sellers': np.int32,
+    'goods_buyers': np.int32
+}
+
+# Scalars and their defaults when a dict leaves them out
+SCALAR_DEFAULTS = {
+    'running': False,
+    'iteration': 0,
+    'market_price': initial_values['market_price'],
+    'production': initial_values['production'],
+    'consumption': initial_values['consumption'],
+    'max_stock': initial_values['max_stock'],
+    'producer_desired_stock': initial_values['producer_desired_stock'],
+    'consumer_desired_stock': initial_values['consumer_desired_stock'],
+    'max_trades': initial_values['max_trades'],
+    'mechanism': initial_values['mechanism'],
+    # Seed of the state's random generator, drawn fresh when left out
+    'seed': None
+}
+
+
+class MarketState:
+    """
+    Simulation state backed by fixed-dtype arrays plus the scratch buffers a tick needs,
+    so stepping it in place allocates nothing per agent. It also carries the run's
+    per-tick history and its own np.random.Generator, so concurrent sessions draw from
+    independent streams and a run is reproducible from its seed.
+
+    It supports the same item access as the sim_data dict (state['market_price']), so
+    update_simulation_parameters, run_simulation_steps and the figures take either.
+    Conversion to and from the dict format only happens at the UI and storage boundary.
+    """
+    __slots__ = tuple(SCALAR_DEFAULTS) + tuple(ARRAY_DTYPES) + ('buffers', 'history', 'rng')
+
+    def __init__(self, min_selling_prices, max_buying_prices, goods_sellers, goods_buyers, rng=None, **scalars):
+        for key, value in SCALAR_DEFAULTS.items():
+            setattr(self, key, scalars.get(key, value))
+        if self.seed is None:
+            self.seed = new_seed()
+        self.rng = rng if rng is not None else np.random.default_rng(self.seed)
+        for key, array in zip(ARRAY_DTYPES, (min_selling_prices, max_buying_prices, goods_sellers, goods_buyers)):
+            setattr(self, key, np.ascontiguousarray(array, dtype=ARRAY_DTYPES[key]))
+        self.buffers = TickBuffers(len(self.goods_sellers), len(self.goods_buyers), dtype=np.int32)
+        self.history = HistoryBuffer()
+
+    @classmethod
+    def from_dict(cls, sim_data):
+        arrays = [sim_data[key] for key in ARRAY_DTYPES]
+        return cls(*arrays, rng=sim_data.get('rng'), **{key: sim_data[key] for key in SCALAR_DEFAULTS if key in sim_data})
+
+    def copy(self):
+        """
+        Copy of the arrays, scalars and generator state with a read-only view of the history
+        and without the tick scratch buffers, for readers on other threads
+        """
+        state = MarketState.__new__(MarketState)
+        for key in SCALAR_DEFAULTS:
+            setattr(state, key, getattr(self, key))
+        for key in ARRAY_DTYPES:
+            setattr(state, key, getattr(self, key).copy())
+        state.buffers = None
+        state.history = self.history.view()
+        state.rng = copy.deepcopy(self.rng)
+        return state
+
+    def to_dict(self):
+        """
+        The sim_data dict format; the arrays are shared, not copied
+        """
+        return {key: getattr(self, key) for key in tuple(SCALAR_DEFAULTS) + tuple(ARRAY_DTYPES)}
+
+    def __getitem__(self, key):
+        if key not in SCALAR_DEFAULTS and key not in ARRAY_DTYPES:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key in ARRAY_DTYPES:
+            value = np.ascontiguousarray(value, dtype=ARRAY_DTYPES[key])
+        elif key not in SCALAR_DEFAULTS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in SCALAR_DEFAULTS or key in ARRAY_DTYPES
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    @property
+    def nbytes(self):
+        buffers = self.buffers.nbytes if self.buffers is not None else 0
+        return sum(getattr(self, key).nbytes for key in ARRAY_DTYPES) + buffers + self.history.nbytes
+
+def new_seed():
+    """
+    Fresh seed from OS entropy, kept below 2 ** 53 so it survives as a JSON number in the browser
+    """
+    return int(np.random.SeedSequence().generate_state(1, np.uint64)[0]) >> 11
+
+def initialize_state(sellers, buyers, seed=None):
+    """
+    Initialize a MarketState with the given number of sellers and buyers. The initial
+    prices and every later tick draw from one generator seeded with seed.
+    """
+    seed = new_seed() if seed is None else seed
+    rng = np.random.default_rng(seed)
+    sim_data = initialize_simulation_data(sellers, buyers, rng)
+    sim_data['seed'] = seed
+    sim_data['rng'] = rng
+    return MarketState.from_dict(sim_data)
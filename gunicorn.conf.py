@@ -0,0 +1,13 @@
+"""
+gunicorn settings, read from the working directory whatever the command line says.
+
+Simulation runners are threads of the process that started them (components/runner.py),
+and a session's requests must reach the process running it, so the app serves every
+session from one worker and scales with threads instead. Refuse to start with more.
+"""
+
+
+def on_starting(server):
+    if server.cfg.workers != 1:
+        raise SystemExit(f'The app supports exactly one gunicorn worker, not {server.cfg.workers}: '
+                         'raise --threads instead')
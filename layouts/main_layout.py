@@ -1,47 +1,80 @@
+import math
+import os
+
 from dash import html, dcc
-import plotly.graph_objs as go
-import numpy as np 
-from components.figures import create_price_figure, create_stock_figure
-
-# Define initial values for the simulation 
-initial_values = {
-    'sellers': 15,
-    'buyers': 15,
-    'production': 1,
-    'consumption': 1,
-    'max_stock': 100,
-    'producer_desired_stock': 50, 
-    'consumer_desired_stock': 50, 
-    'max_trades': 30,
-    'market_price': 50
-} 
-
-def initialize_simulation_data(sellers, buyers):
+from components.simulation import initial_values
+from components.profiling import PROFILER, DEBUG_PANEL
+
+# Next to the repository root, wherever the app is started from 
+MARKDOWN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'markDown.md')
+
+# The ticks per second slider goes up to 10 ** TICKS_PER_SECOND_MAX_EXPONENT 
+TICKS_PER_SECOND_MAX_EXPONENT = 4
+
+# The sellers and buyers sliders move along log10 of the agent count, up to 10 ** AGENTS_MAX_EXPONENT. 
+# Above HISTOGRAM_THRESHOLD agents the figures switch to binned distributions 
+AGENTS_MAX_EXPONENT = 5
+AGENTS_MARKS = {exponent: str(10 ** exponent) for exponent in range(AGENTS_MAX_EXPONENT + 1)}
+
+# Markets (goods) a session can simulate side by side 
+MARKETS_MAX = 100
+
+def market_options(markets):
+    return [{'label': f'Good {market + 1}', 'value': market} for market in range(markets)]
+
+def mechanism_options(markets):
+    # The order book only runs on a single market
+    return [{'label': ' Random pairing', 'value': 'random'},
+            {'label': ' Order book (continuous double auction)', 'value': 'auction', 'disabled': markets > 1}]
+
+def agents_to_slider(agents):
+    return round(math.log10(agents), 2)
+
+def slider_to_agents(value):
+    return max(int(round(10 ** value)), 1)
+
+def initial_store_data():
     """
-    Initialize the simulation data with given number of sellers and buyers.
+    The browser only holds the session id and a few scalars; the agent arrays live in the session store.
+    The first update_simulation of a page load picks the session id, so the layout is the same for
+    every page and is built once.
     """
-    sellers = int(sellers) 
-    buyers = int(buyers) 
-
     return {
         'running': False,
         'iteration': 0,
-        'market_price': initial_values['market_price'],
-        'min_selling_prices': np.random.randint(1, initial_values['market_price'] * 2, sellers).tolist(),
-        'max_buying_prices': np.random.randint(1, initial_values['market_price'] * 2, buyers).tolist(),
-        'goods_sellers': [initial_values['producer_desired_stock']] * sellers,
-        'goods_buyers': [initial_values['consumer_desired_stock']] * buyers, 
-        'production': initial_values['production'],
-        'consumption': initial_values['consumption']
+        'market_price': initial_values['market_price']
     }
 
+def debug_panel():
+    """
+    Components of the profiling panel, or none when it is turned off
+    """
+    if not DEBUG_PANEL:
+        return []
+    return [
+        html.Details([
+            html.Summary('Debug: phase timings (ms)', style={'fontSize': '12px'}),
+            dcc.Checklist(
+                id='profile-toggle',
+                options=[{'label': ' Profile phases', 'value': 'on'}],
+                value=['on'] if PROFILER.enabled else [],
+                style={'fontSize': '12px'}
+            ),
+            html.Table(id='profile-table', style={'fontSize': '12px', 'fontFamily': 'monospace', 'width': '100%'}),
+            dcc.Interval(id='profile-interval', interval=2000, n_intervals=0)
+        ], style={'width': '80%', 'margin': '0 auto 20px auto'})
+    ]
+
 # Read markdown 
 def read_markdown_file(markdown_file):
     with open(markdown_file, 'r') as file:
         return file.read() 
 
 def main_layout(): 
-    markDown = read_markdown_file("markDown.md")
+    """
+    The page's components. Nothing in it depends on the request, so app.py builds it once at startup.
+    """
+    markDown = read_markdown_file(MARKDOWN_FILE)
 
     layout = html.Div([ 
         dcc.Location(id='url', refresh=False), 
@@ -49,7 +82,8 @@ def main_layout():
         # Container 
         html.Div([
             dcc.Graph(id='price-graph'),
-            dcc.Graph(id='stock-graph') 
+            dcc.Graph(id='stock-graph'),
+            dcc.Graph(id='history-graph') 
         ], style={'position': 'top'}),  
         # Market Price Slider 
         html.Div([
@@ -69,15 +103,14 @@ def main_layout():
         html.Div([
             # Producers (Sellers) Sliders
             html.Div([
-                html.Label('Producers (Sellers):', style={'fontSize': '12px', 'marginRight': '10px'}),
+                html.Label(['Producers (Sellers): ', html.Span(initial_values['sellers'], id='sellers-count')], style={'fontSize': '12px', 'marginRight': '10px'}),
                 dcc.Slider(
                     id='sellers-slider',
-                    min=1,
-                    max=40,
-                    value=initial_values['sellers'],
-                    step=1,
-                    tooltip={"placement": "bottom", "always_visible": True},
-                    marks={1: '1', 40: '40', initial_values['sellers']: str(initial_values['sellers'])}
+                    min=0,
+                    max=AGENTS_MAX_EXPONENT,
+                    value=agents_to_slider(initial_values['sellers']),
+                    step=0.01,
+                    marks=AGENTS_MARKS
                 ),
                 html.Label('Production Rate:', style={'fontSize': '12px', 'marginRight': '10px'}),
                 dcc.Slider(
@@ -103,15 +136,14 @@ def main_layout():
 
             # Consumers 
             html.Div([
-                html.Label('Consumers (Buyers):', style={'fontSize': '12px', 'marginRight': '10px'}),
+                html.Label(['Consumers (Buyers): ', html.Span(initial_values['buyers'], id='buyers-count')], style={'fontSize': '12px', 'marginRight': '10px'}),
                 dcc.Slider(
                     id='buyers-slider',
-                    min=1,
-                    max=40,
-                    value=initial_values['buyers'],
-                    step=1,
-                    tooltip={"placement": "bottom", "always_visible": True},
-                    marks={1: '1', 40: '40', initial_values['buyers']: str(initial_values['buyers'])}
+                    min=0,
+                    max=AGENTS_MAX_EXPONENT,
+                    value=agents_to_slider(initial_values['buyers']),
+                    step=0.01,
+                    marks=AGENTS_MARKS
                 ),
                 html.Label('Consumption Rate:', style={'fontSize': '12px', 'marginRight': '10px'}),
                 dcc.Slider(
@@ -165,6 +197,72 @@ def main_layout():
             ], style={'width': '48%', 'display': 'inline-block'})
         ], style={'display': 'flex', 'justifyContent': 'space-between'}),
 
+        # Market Mechanism: random pairing at the market price or a continuous double auction 
+        html.Div([
+            html.Label('Market Mechanism:', style={'fontSize': '12px', 'marginRight': '10px'}),
+            dcc.RadioItems(
+                id='mechanism-radio',
+                options=mechanism_options(initial_values['markets']),
+                value=initial_values['mechanism'],
+                inline=True,
+                inputStyle={'marginLeft': '10px'},
+                style={'fontSize': '12px'}
+            )
+        ], style={'display': 'flex', 'alignItems': 'center', 'marginTop': '10px'}),
+
+        # Markets: goods simulated side by side, substitution between them and the market drawn 
+        html.Div([
+            html.Div([
+                html.Label('Markets (Goods):', style={'fontSize': '12px', 'marginRight': '10px'}),
+                dcc.Slider(
+                    id='markets-slider',
+                    min=1,
+                    max=MARKETS_MAX,
+                    value=initial_values['markets'],
+                    step=1,
+                    tooltip={"placement": "bottom", "always_visible": True},
+                    marks={1: '1', MARKETS_MAX: str(MARKETS_MAX)}
+                )
+            ], style={'width': '32%', 'display': 'inline-block'}),
+
+            html.Div([
+                html.Label('Substitution Between Goods:', style={'fontSize': '12px', 'marginRight': '10px'}),
+                dcc.Slider(
+                    id='coupling-slider',
+                    min=0,
+                    max=1,
+                    value=initial_values['coupling'],
+                    step=0.1,
+                    tooltip={"placement": "bottom", "always_visible": True},
+                    marks={0: '0', 1: '1'}
+                )
+            ], style={'width': '32%', 'display': 'inline-block'}),
+
+            html.Div([
+                html.Label('View Market:', style={'fontSize': '12px', 'marginRight': '10px'}),
+                dcc.Dropdown(
+                    id='market-dropdown',
+                    options=market_options(initial_values['markets']),
+                    value=0,
+                    clearable=False,
+                    style={'fontSize': '12px'}
+                )
+            ], style={'width': '32%', 'display': 'inline-block'})
+        ], style={'display': 'flex', 'justifyContent': 'space-between', 'marginTop': '10px'}),
+
+        # Ticks per Second Slider: speed of the background runner, in powers of ten 
+        html.Div([
+            html.Label('Ticks per Second:', style={'fontSize': '12px', 'marginRight': '10px'}),
+            dcc.Slider(
+                id='ticks-per-second-slider',
+                min=0,
+                max=TICKS_PER_SECOND_MAX_EXPONENT,
+                value=0,
+                step=1,
+                marks={exponent: str(10 ** exponent) for exponent in range(TICKS_PER_SECOND_MAX_EXPONENT + 1)}
+            )
+        ], style={'marginBottom': '0px', 'marginTop': '10px', 'width': '100%'}),
+
         # Control Buttons: Reset, Start 
         html.Div([
             html.Button('Reset', id='reset-button', n_clicks=0,
@@ -172,6 +270,17 @@ def main_layout():
             html.Button('Start', id='start-button', n_clicks=0,
                         style={'fontSize': '16px', 'padding': '10px 20px', 'backgroundColor': 'green', 'color': 'white'})
         ], style={'display': 'flex', 'justifyContent': 'center', 'gap': '20px', 'padding': '20px'}), 
+
+        # Replay: the seed the next reset uses (random when empty) and a jump to an earlier tick, or a bounded way ahead 
+        html.Div([
+            html.Label('Seed:', style={'fontSize': '12px'}),
+            dcc.Input(id='seed-input', type='number', min=0, step=1, placeholder='random', debounce=True,
+                      style={'fontSize': '12px', 'width': '140px'}),
+            html.Label('Tick:', style={'fontSize': '12px', 'marginLeft': '20px'}),
+            dcc.Input(id='seek-input', type='number', min=0, step=1, placeholder='0',
+                      style={'fontSize': '12px', 'width': '100px'}),
+            html.Button('Seek', id='seek-button', n_clicks=0, style={'fontSize': '12px'})
+        ], style={'display': 'flex', 'justifyContent': 'center', 'alignItems': 'center', 'gap': '8px', 'paddingBottom': '10px'}), 
         
         # Markdown Text Box 
         html.Div(
@@ -196,7 +305,13 @@ def main_layout():
         ), 
 
         # Data Storage
-        dcc.Store(id='simulation-data', data=initialize_simulation_data(initial_values['sellers'], initial_values['buyers'])) 
+        dcc.Store(id='simulation-data', data=initial_store_data()), 
+
+        # Set by the client-side stream renderer, see assets/stream.js 
+        html.Div(id='stream-status', style={'display': 'none'}), 
+
+        # Debug Panel: per-phase timings, only with DEBUG_PANEL=1 
+        *debug_panel() 
     ], style={'fontFamily': 'Arial, sans-serif', 'maxWidth': '900px', 'position': 'relative', 'margin': 'auto'}) 
    
    
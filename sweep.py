@@ -0,0 +1,311 @@
+"""
+Headless parameter sweeps over the market simulation.
+
+Every configuration is run for a fixed number of ticks with each of the given seeds, spread
+across a process pool. One JSON line per finished run is appended to the output file as it
+completes, and the output doubles as the checkpoint: rerunning the same command skips every
+run already in it. Runs are matched on a hash of everything their result depends on, the
+parameters, seed, ticks, --early-stop and convergence settings, so changing any of them reruns
+the affected runs instead of keeping results made with the old ones.
+
+Examples:
+    python sweep.py --grid production=1,2,3 --grid max_trades=10,30,80 --ticks 1000 --seeds 0 1 2
+    python sweep.py --sample 10000 --range sellers=1:40 --ticks 5000 --output sweep.jsonl
+    python sweep.py --grid production=1,2 --ticks 10000 --record runs
+
+With --record every run also writes its per-tick agent arrays to a columnar recording,
+runs/config-<config>-seed-<seed>, readable with components.recording.RunReader.
+
+Every run reports the tick its market settled at and the equilibrium price, as found by
+components.convergence.ConvergenceDetector, or null when it did not settle within --ticks.
+With --early-stop a run stops shortly after its market settles instead of running to --ticks:
+    python sweep.py --sample 10000 --ticks 20000 --early-stop --window 1000
+
+With --replicas N each configuration and seed runs as an ensemble of N replicas stepped
+together by components.ensemble.run_ensemble, and reports the spread of the market price
+across them instead of a single market's. The replicas draw from streams spawned from the
+seed, so replica i of seed s is not the same run as a plain run with seed s:
+    python sweep.py --grid production=1,2,3 --ticks 1000 --replicas 200
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from components.convergence import ConvergenceDetector, run_to_equilibrium, DEFAULT_WINDOW, DEFAULT_STOCK_TOLERANCE
+from components.ensemble import initialize_ensemble, run_ensemble
+from components.simulation import initial_values, update_simulation_parameters, run_simulation_steps
+from components.state import initialize_state
+from components.recording import RunWriter
+
+# Parameters that can be swept and their slider bounds, used as the default sampling ranges.
+# The agent sliders stop at 10 ** 5
+PARAMETER_RANGES = {
+    'sellers': (1, 10 ** 5),
+    'buyers': (1, 10 ** 5),
+    'production': (0, 10),
+    'consumption': (0, 10),
+    'max_stock': (10, 150),
+    'producer_desired_stock': (0, 100),
+    'consumer_desired_stock': (1, 100),
+    'max_trades': (1, 80),
+    'market_price': (0, 100)
+}
+# Sampled uniformly in log10, as the sliders move, so small markets are drawn as often as large ones
+LOG_PARAMETERS = ('sellers', 'buyers')
+
+
+def parse_assignment(text):
+    name, _, value = text.partition('=')
+    if name not in PARAMETER_RANGES or not value:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with NAME one of {', '.join(PARAMETER_RANGES)}, got '{text}'")
+    return name, value
+
+def parse_grid(text):
+    name, value = parse_assignment(text)
+    return name, [int(v) for v in value.split(',')]
+
+def parse_range(text):
+    name, value = parse_assignment(text)
+    low, _, high = value.partition(':')
+    return name, (int(low), int(high))
+
+def grid_configurations(grid):
+    """
+    Every combination of the grid values; parameters not in the grid keep their initial value
+    """
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = {name: initial_values[name] for name in PARAMETER_RANGES}
+        params.update(zip(names, values))
+        yield params
+
+def sampled_configurations(samples, ranges, sample_seed):
+    """
+    Random configurations, uniform in each range or in log10 of it for LOG_PARAMETERS;
+    configuration i only depends on (sample_seed, i)
+    """
+    for index in range(samples):
+        rng = np.random.default_rng([sample_seed, index])
+        yield {name: sample_parameter(rng, name, low, high) for name, (low, high) in ranges.items()}
+
+def sample_parameter(rng, name, low, high):
+    if name in LOG_PARAMETERS:
+        value = int(round(10 ** rng.uniform(np.log10(low), np.log10(high))))
+        return min(max(value, low), high)
+    return int(rng.integers(low, high, endpoint=True))
+
+def run_key(params, seed, ticks, early_stop, convergence, replicas=None):
+    """
+    Hash of everything a run's result depends on
+    """
+    settings = [params, seed, ticks, early_stop, convergence]
+    # Single market runs keep the keys they had before ensembles
+    if replicas is not None:
+        settings.append(replicas)
+    return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+def run_configuration(task):
+    """
+    Run one configuration with one seed for a fixed horizon, or until it settles with
+    early_stop, and summarize it
+    """
+    config, seed, params, ticks, record, early_stop, convergence = task
+    start = time.perf_counter()
+
+    # Each run has its own generator, so results don't depend on which worker ran it
+    sim_data = initialize_state(params['sellers'], params['buyers'], seed=seed)
+    update_simulation_parameters(sim_data, params['production'], params['consumption'], params['max_stock'],
+                                 params['producer_desired_stock'], params['consumer_desired_stock'],
+                                 params['max_trades'], params['market_price'])
+    sim_data['running'] = True
+    detector = ConvergenceDetector.for_state(sim_data, **convergence)
+    if record is not None:
+        sim_data, history = run_recorded(sim_data, ticks, os.path.join(record, f'config-{config}-seed-{seed}'),
+                                         dict(params, config=config, seed=seed), detector, early_stop)
+    elif early_stop:
+        sim_data, history = run_to_equilibrium(sim_data, ticks, detector)
+    else:
+        sim_data, history = run_simulation_steps(sim_data, ticks)
+        detector.feed(history)
+
+    return {
+        'run_key': run_key(params, seed, ticks, early_stop, convergence),
+        'config': config,
+        'seed': seed,
+        **params,
+        'ticks': ticks,
+        'ticks_run': len(history['iteration']),
+        'equilibrium_tick': detector.equilibrium_tick,
+        'equilibrium_price': detector.equilibrium_price,
+        'final_market_price': int(sim_data['market_price']),
+        'mean_market_price': float(history['market_price'].mean()),
+        'std_market_price': float(history['market_price'].std()),
+        'total_trades': int(history['trades'].sum()),
+        'mean_goods_sellers': float(sim_data['goods_sellers'].mean()),
+        'mean_goods_buyers': float(sim_data['goods_buyers'].mean()),
+        'elapsed': time.perf_counter() - start
+    }
+
+def run_ensemble_configuration(task):
+    """
+    Run one configuration as an ensemble of replicas seeded from one seed, and summarize
+    the market price across the replicas
+    """
+    config, seed, params, ticks, replicas = task
+    start = time.perf_counter()
+
+    ensemble = initialize_ensemble(replicas, params['sellers'], params['buyers'], seed=seed)
+    update_simulation_parameters(ensemble, params['production'], params['consumption'], params['max_stock'],
+                                 params['producer_desired_stock'], params['consumer_desired_stock'],
+                                 params['max_trades'], params['market_price'])
+    ensemble['running'] = True
+    ensemble, history = run_ensemble(ensemble, ticks)
+
+    return {
+        'run_key': run_key(params, seed, ticks, False, None, replicas),
+        'config': config,
+        'seed': seed,
+        'replicas': replicas,
+        **params,
+        'ticks': ticks,
+        'ticks_run': len(history['iteration']),
+        'final_mean_market_price': float(history['mean_market_price'][-1]),
+        'final_std_market_price': float(history['std_market_price'][-1]),
+        'final_market_price_quantiles': dict(zip(map(str, history['quantiles'].tolist()),
+                                                 history['market_price_quantiles'][-1].tolist())),
+        'mean_market_price': float(history['mean_market_price'].mean()),
+        'mean_trades': float(history['mean_trades'].mean()),
+        'mean_goods_sellers': float(ensemble['goods_sellers'].mean()),
+        'mean_goods_buyers': float(ensemble['goods_buyers'].mean()),
+        'elapsed': time.perf_counter() - start
+    }
+
+def run_recorded(sim_data, ticks, path, metadata, detector, early_stop=False):
+    """
+    run_simulation_steps, also recording the agent arrays after every tick and feeding the
+    detector; with early_stop, only until the detector finds the market settled
+    """
+    steps = []
+    with RunWriter(path, len(sim_data['goods_sellers']), len(sim_data['goods_buyers']),
+                   metadata=metadata, overwrite=True, ticks=ticks) as writer:
+        for _ in range(ticks):
+            sim_data, step = run_simulation_steps(sim_data, 1)
+            writer.append(sim_data)
+            steps.append(step)
+            if detector.feed(step) and early_stop:
+                break
+    history = {name: np.concatenate([step[name] for step in steps]) for name in steps[0]} if steps else {}
+    return sim_data, history
+
+def completed_runs(output):
+    """
+    Run keys already in the output file; lines from before run keys were written count as
+    not done. A line cut short by an interrupted run is dropped so the file stays valid JSON lines.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+
+    valid_bytes = 0
+    with open(output, 'rb') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                break
+            if 'run_key' in result:
+                done.add(result['run_key'])
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(output):
+        with open(output, 'r+b') as file:
+            file.truncate(valid_bytes)
+    return done
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', type=parse_grid, action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='values to sweep for one parameter; repeat for a full grid')
+    parser.add_argument('--sample', type=int, metavar='N', help='run N random configurations instead of a grid')
+    parser.add_argument('--range', type=parse_range, action='append', default=[], metavar='NAME=LOW:HIGH',
+                        help='sampling range for one parameter (defaults to the slider bounds, '
+                             f"sellers and buyers 1:{PARAMETER_RANGES['sellers'][1]} in log10)")
+    parser.add_argument('--sample-seed', type=int, default=0, help='seed for drawing the random configurations')
+    parser.add_argument('--ticks', type=int, default=1000, help='iterations per run')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help='simulation seeds, each configuration runs once per seed')
+    parser.add_argument('--replicas', type=int, metavar='N',
+                        help='run every configuration and seed as an ensemble of N replicas')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='size of the process pool')
+    parser.add_argument('--output', default='sweep.jsonl', help='JSON lines file results are appended to')
+    parser.add_argument('--record', metavar='DIR', help='also record every run tick by tick under DIR')
+    parser.add_argument('--early-stop', action='store_true', help='stop each run once its market has settled')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='ticks the convergence statistics are taken over')
+    parser.add_argument('--price-tolerance', type=float,
+                        help='largest standard deviation and drift of the market price of a settled market '
+                             "(defaults to a tenth of the agents' mean starting price)")
+    parser.add_argument('--stock-tolerance', type=float, default=DEFAULT_STOCK_TOLERANCE,
+                        help='largest standard deviation and drift of the stock imbalance per agent of a settled market')
+    args = parser.parse_args()
+    if args.ticks < 1:
+        parser.error('--ticks must be at least 1')
+    if args.window < 2:
+        parser.error('--window must be at least 2 ticks')
+    if args.replicas is not None:
+        if args.replicas < 1:
+            parser.error('--replicas must be at least 1')
+        if args.record or args.early_stop:
+            parser.error('--replicas runs every replica to --ticks and records none of them: '
+                         'it cannot be combined with --record or --early-stop')
+
+    if args.sample is not None:
+        ranges = dict(PARAMETER_RANGES)
+        ranges.update(args.range)
+        if any(ranges[name][0] < 1 for name in LOG_PARAMETERS):
+            parser.error(f"the sampling ranges of {' and '.join(LOG_PARAMETERS)} must start at 1 or more")
+        configurations = sampled_configurations(args.sample, ranges, args.sample_seed)
+        total = args.sample * len(args.seeds)
+    else:
+        grid = dict(args.grid)
+        configurations = grid_configurations(grid)
+        total = int(np.prod([len(values) for values in grid.values()])) * len(args.seeds)
+
+    done = completed_runs(args.output)
+    convergence = {'window': args.window, 'price_tolerance': args.price_tolerance, 'stock_tolerance': args.stock_tolerance}
+    if args.replicas is not None:
+        worker = run_ensemble_configuration
+        tasks = [(config, seed, params, args.ticks, args.replicas)
+                 for config, params in enumerate(configurations)
+                 for seed in args.seeds
+                 if run_key(params, seed, args.ticks, False, None, args.replicas) not in done]
+    else:
+        worker = run_configuration
+        tasks = [(config, seed, params, args.ticks, args.record, args.early_stop, convergence)
+                 for config, params in enumerate(configurations)
+                 for seed in args.seeds
+                 if run_key(params, seed, args.ticks, args.early_stop, convergence) not in done]
+
+    finished = total - len(tasks)
+    print(f'{finished}/{total} runs already in {args.output}')
+    with Pool(args.workers) as pool, open(args.output, 'a') as output:
+        for result in pool.imap_unordered(worker, tasks, chunksize=4):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            finished += 1
+            if 'replicas' in result:
+                outcome = (f"market price {result['final_mean_market_price']:.1f} "
+                           f"+/- {result['final_std_market_price']:.1f} over {result['replicas']} replicas")
+            else:
+                settled = ('not settled' if result['equilibrium_tick'] is None else
+                           f"settled at tick {result['equilibrium_tick']} price {result['equilibrium_price']:.1f}")
+                outcome = f"market price {result['final_market_price']}, {settled}"
+            print(f"{finished}/{total} config {result['config']} seed {result['seed']}: "
+                  f"{outcome} ({result['elapsed']:.2f}s)", flush=True)
+
+
+if __name__ == '__main__':
+    main()